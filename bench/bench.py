@@ -0,0 +1,394 @@
+#! /usr/bin/env python3
+
+# Times each stage of running a line of dq (lexing, parsing, optimizing,
+#   building the queue, taking its elements, and printing it) on synthetic
+#   programs of growing size, and records how much memory each one needs at
+#   its peak.
+#
+#   python bench/bench.py                     print a table of the results
+#   python bench/bench.py --out new.json      ... and save them
+#   python bench/bench.py --compare old.json  ... and exit with status 1 if any
+#                                             stage got slower (or hungrier)
+#                                             than old.json by more than the
+#                                             threshold
+#   python bench/bench.py --suite memory      print the bytes taken by each
+#                                             token, tree, queue and element
+#   python bench/bench.py --suite stream      print the memory in use while
+#                                             streaming a million elements
+#   python bench/bench.py --suite parsers     time the precedence-climbing
+#                                             parser against the legacy one
+#
+# The build, iterate and print stages are fed the tree straight from the
+#   parser, as the optimizer would fold most of these programs down to a
+#   single token and leave nothing for them to do.
+
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import gc, json, platform, subprocess, tracemalloc
+from time       import perf_counter
+from statistics import median
+
+from lexer     import Token, TokenStream
+from parser    import _parse, _parse_legacy, ParseTree
+import optimizer
+from evaluator import makeQueue, smartPrint, printRepr, Writer, Queue, String, GLOBALS, elements
+
+
+################################################################################
+
+
+# Each generator returns a program of the given size. Sizes grow by a factor
+#   of four, so a stage that scales linearly takes about four times as long
+#   at each step.
+
+def concat(n):
+    # a long chain of concatenations, one part per operator
+    return " + ".join(['"ab" ~ [1, 2]'] * n)
+
+def nested(n):
+    # a literal nested n deep, with a few elements at each level
+    return "[1, " * n + '"ab"' + "]" * n
+
+def natural(n):
+    # a single natural with n elements
+    return str(n)
+
+def string(n):
+    # a single string literal n characters long
+    return '"' + "abcdefghij" * (n // 10) + '"'
+
+def star(n):
+    # a string repeated n times
+    return '"abcdefghij" * ' + str(n)
+
+CASES = {
+    'concat':  (concat,  [250, 1000, 4000]),
+    'nested':  (nested,  [250, 1000, 4000]),
+    'natural': (natural, [10**4 * 4**k for k in range(3)]),
+    'string':  (string,  [10**4 * 4**k for k in range(3)]),
+    'star':    (star,    [10**3 * 4**k for k in range(3)]),
+}
+
+
+################################################################################
+
+
+# Throws away whatever the printers write, counting the characters.
+#
+class Sink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text)
+
+    def flush(self):
+        pass
+
+
+# Returns the tokens of a one-line program, without the newline at its end.
+#
+def tokens(text):
+    stream, line = TokenStream(text), []
+    while (tok := next(stream)) is not None:
+        if tok.cls != 'newline':
+            line.append(tok)
+    return line
+
+def count(queue):
+    n = 0
+    for _ in queue:
+        n += 1
+    return n
+
+def printing(printer):
+    def run(queue):
+        out = Writer(Sink())
+        printer(queue, out)
+        out.flush()
+    return run
+
+
+# Each stage is a pair of functions: one that prepares its input from the
+#   text of the program (which isn't timed), and one that does the work. The
+#   input is prepared afresh for every run, since queues are used up by
+#   taking their elements.
+#
+STAGES = {
+    'lex':       (lambda text: text,
+                  tokens),
+    'parse':     (lambda text: tokens(text),
+                  lambda line: _parse(line, True)),
+    'optimize':  (lambda text: _parse(tokens(text), True),
+                  optimizer.optimize),
+    'build':     (lambda text: _parse(tokens(text), True),
+                  makeQueue),
+    'iterate':   (lambda text: makeQueue(_parse(tokens(text), True)),
+                  count),
+    'print':     (lambda text: makeQueue(_parse(tokens(text), True)),
+                  printing(smartPrint)),
+    'printRepr': (lambda text: makeQueue(_parse(tokens(text), True)),
+                  printing(printRepr)),
+}
+
+
+# Returns the best and median times over `repeat` runs of the stage (after
+#   `warmup` runs that aren't counted), and the most memory that was in use at
+#   once during one more run, over what its input already took.
+#
+def measure(stage, text, repeat, warmup):
+    prepare, run = STAGES[stage]
+    times = []
+    for n in range(warmup + repeat):
+        arg = prepare(text)
+        gc.collect()
+        start = perf_counter()
+        run(arg)
+        if n >= warmup:
+            times.append(perf_counter() - start)
+        del arg
+
+    # (tracemalloc slows everything down, so the peak gets a run of its own.)
+    arg = prepare(text)
+    gc.collect()
+    tracemalloc.start()
+    run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'best': min(times), 'median': median(times), 'peak': peak}
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(cases, stages, repeat, warmup, quick):
+    results = {}
+    for case in cases:
+        generate, sizes = CASES[case]
+        previous = {}
+        for size in (sizes[:2] if quick else sizes):
+            text = generate(size) + "\n"
+            for stage in stages:
+                key = f"{case}/{size}/{stage}"
+                result = results[key] = measure(stage, text, repeat, warmup)
+                # How much longer it took than at the last size, which is
+                #   about 4x for a stage that scales linearly.
+                growth = f"x{result['best'] / previous[stage]:5.1f}" if previous.get(stage) else ""
+                previous[stage] = result['best']
+                print(f"{key:28} {result['best'] * 1e3:10.3f} ms  "
+                      f"(median {result['median'] * 1e3:10.3f} ms)  {growth:6}  "
+                      f"{result['peak'] / 1024:10.1f} KB peak", flush=True)
+    return results
+
+
+# Returns a line for each stage that got slower than in the baseline by more
+#   than `threshold` (as a fraction of its old time), or used more memory at
+#   its peak by more than `memory` (if that's given). Stages that took less
+#   than `floor` seconds either time are too noisy to judge and are skipped.
+#
+def regressions(results, baseline, threshold, memory, floor):
+    found = []
+    for key, new in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        if max(old['best'], new['best']) >= floor and new['best'] > old['best'] * (1 + threshold):
+            found.append(f"{key}: {old['best'] * 1e3:.3f} ms -> {new['best'] * 1e3:.3f} ms "
+                         f"(+{(new['best'] / old['best'] - 1) * 100:.0f}%)")
+        if memory is not None and new['peak'] > old['peak'] * (1 + memory):
+            found.append(f"{key}: {old['peak'] / 1024:.1f} KB -> {new['peak'] / 1024:.1f} KB peak "
+                         f"(+{(new['peak'] / max(old['peak'], 1) - 1) * 100:.0f}%)")
+    return found
+
+
+################################################################################
+
+
+# Finds the objects of the given classes that can be reached from root, and
+#   returns how many there are.
+#
+def census(root, classes):
+    seen, stack, found = set(), [root], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, classes):
+            found += 1
+            stack.extend(getattr(obj, name) for cls in type(obj).__mro__
+                                            for name in getattr(cls, '__slots__', ())
+                                            if hasattr(obj, name))
+            stack.extend(getattr(obj, '__dict__', {}).values())
+    return found
+
+
+# Returns what build returns, and how many bytes were allocated by it and
+#   still in use afterwards, as measured by tracemalloc (so that anything a
+#   node owns, like a __dict__, counts towards it).
+#
+def traced(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, used
+
+
+# Prints the average number of bytes taken by each token and tree of a few
+#   representative programs, each queue built for them, and each element
+#   taken from those queues.
+#
+LAYOUTS = [' + '.join(['"abc" ~ [1, x]'] * 2000),
+           '[' + ', '.join(['"abcdefghij" * 2'] * 2000) + ']',
+           '_[' + ', '.join(['[1, "ab", x]'] * 2000) + ']',
+           '"abcdefghij" * 20000']
+
+def memory():
+    for program in LAYOUTS:
+        GLOBALS['x'] = String("xyz")
+        tree, parsed = traced(lambda: _parse(tokens(program + "\n"), True))
+        queue, built = traced(lambda: makeQueue(tree))
+        # (Counted before taking the elements, which lets go of the queues
+        #   that run out.)
+        queues = census(queue, Queue)
+        taken, took  = traced(lambda: list(elements(queue)))
+        label = program if len(program) < 30 else program[:27] + "..."
+        print(f"{label:30}"
+              f"  {parsed / census(tree, (Token, ParseTree)):6.1f} B/token or tree"
+              f"  {built / queues:6.1f} B/queue"
+              f"  {took / max(len(taken), 1):6.1f} B/element", flush=True)
+
+
+# Takes a million elements, one at a time, from each of a few programs that
+#   stream through Concat, Flatten and Zip, and prints how much memory was in
+#   use after the first and the last hundred thousand (which should be about
+#   the same), and how many queues could still be reached from the one being
+#   read before and after.
+#
+STREAMS = [' + '.join(['(1000 ~ $"abc")'] * 1000),
+           '_[' + ', '.join(['"abcdefghij" * 100'] * 1000) + ']',
+           '_(' + ' + '.join(['[1000 ~ $"abc"]'] * 1000) + ')',
+           '(1000000 ~ $"ab") ~ (1000000 ~ $"cd")']
+
+def stream():
+    for program in STREAMS:
+        queue = makeQueue(_parse(tokens(program + "\n"), True))
+        before = census(queue, Queue)
+        gc.collect()
+        tracemalloc.start()
+        used, n = [], 0
+        for _ in queue:
+            n += 1
+            if n % 100000 == 0:
+                used.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        label = program if len(program) < 30 else program[:27] + "..."
+        print(f"{label:30}  {n:8} elements"
+              f"  {used[0] / 1024:6.1f} KB -> {used[-1] / 1024:6.1f} KB in use"
+              f"  {before:5} -> {census(queue, Queue):5} queues", flush=True)
+
+
+# Prints the best time each parser takes on each of a few nested literals and
+#   long expressions.
+#
+def nest(depth):
+    return "[" * depth + "]" * depth
+
+PARSES = ["[[[[[[], [[[]]], []], []], [[[[[], []]]], [[[[], [], [[]]], []]]], [[[]]]], []]]",
+          "[[[[], [[]], [[[[]], [], [[[[]], [], []]]]]], [[[[[]], []], [], [[[]]]], [[]]]]]",
+          "[[[], [[[], [[[[[]], [], []]]]], [], []]], [[[]], [[], []], [[], [], []]], []]",
+          nest(100), nest(400),
+          " + ".join(["x"] * 1000),
+          " + ".join(["$x ~ (y * 2)"] * 300),
+          "[" + ", ".join(["[1, 2, 3]"] * 500) + "]"]
+
+def parsers(repeat = 5):
+    for text in PARSES:
+        line, times = tokens(text + "\n"), []
+        for parse in (_parse_legacy, _parse):
+            best = float('inf')
+            for _ in range(repeat):
+                start = perf_counter()
+                parse(line, True)
+                best = min(best, perf_counter() - start)
+            times.append(best * 1e3)
+        label = text if len(text) < 30 else text[:27] + "..."
+        print(f"{label:30}  {len(line):6} tokens"
+              f"  legacy {times[0]:9.3f} ms  climbing {times[1]:9.3f} ms"
+              f"  ({times[0] / times[1]:.1f}x)", flush=True)
+
+SUITES = {'memory': memory, 'stream': stream, 'parsers': parsers}
+
+
+if __name__ == '__main__':
+
+    from argparse import ArgumentParser
+
+    args = ArgumentParser(description="Benchmarks the stages of running dq programs.")
+    args.add_argument('--suite', choices=['stages', *SUITES], default='stages',
+                      help="what to measure: the time each stage takes (the default), the "
+                           "bytes taken by each token, tree, queue and element, the memory "
+                           "in use while streaming a million elements, or the time each "
+                           "parser takes")
+    args.add_argument('--cases', default=",".join(CASES),
+                      help="comma-separated programs to run (default: all of %(default)s)")
+    args.add_argument('--stages', default=",".join(STAGES),
+                      help="comma-separated stages to time (default: all of %(default)s)")
+    args.add_argument('--repeat', type=int, default=5, help="timed runs of each stage")
+    args.add_argument('--warmup', type=int, default=1, help="untimed runs before those")
+    args.add_argument('--quick', action='store_true', help="only run the two smallest sizes")
+    args.add_argument('--out', help="save the results to this JSON file")
+    args.add_argument('--compare', help="JSON file from an earlier run to compare against")
+    args.add_argument('--threshold', type=float, default=0.25,
+                      help="fail if a stage's best time grows by more than this fraction")
+    args.add_argument('--memory-threshold', type=float,
+                      help="fail if a stage's peak memory grows by more than this fraction")
+    args.add_argument('--floor', type=float, default=0.001,
+                      help="ignore the times of stages faster than this many seconds")
+    args = args.parse_args()
+
+    if args.suite in SUITES:
+        SUITES[args.suite]()
+        sys.exit()
+
+    cases, stages = args.cases.split(","), args.stages.split(",")
+    for name in cases:
+        if name not in CASES:
+            sys.exit(f"bench: unknown case {name!r}")
+    for name in stages:
+        if name not in STAGES:
+            sys.exit(f"bench: unknown stage {name!r}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    results = run(cases, stages, args.repeat, args.warmup, args.quick)
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            json.dump({'commit':  commit(),
+                       'python':  platform.python_version(),
+                       'repeat':  args.repeat,
+                       'warmup':  args.warmup,
+                       'results': results}, file, indent=2)
+
+    if baseline is not None:
+        found = regressions(results, baseline['results'], args.threshold,
+                            args.memory_threshold, args.floor)
+        for line in found:
+            print(f"\x1B[91mregression\x1B[39m: {line}")
+        if found:
+            sys.exit(1)
+        print(f"no regressions against {baseline.get('commit') or args.compare}")
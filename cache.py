@@ -0,0 +1,167 @@
+import hashlib, marshal, os, sys, zlib
+
+import lexer, parser, optimizer
+from lexer  import Token
+from parser import ParseTree
+
+# Running a script lexes, parses, and optimizes every line of it before running
+#   it, and that's the same work every time the script hasn't changed. This
+#   keeps the optimized trees of each script that ran to the end in a .dqc file
+#   of its own, named after a hash of the script and of the interpreter, so a
+#   script that runs again can skip straight to evaluating them.
+
+
+# Where the .dqc files are kept.
+#
+DIRECTORY = os.environ.get('DQ_CACHE_DIR') or \
+            os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                         os.path.expanduser(os.path.join('~', '.cache')), 'dq')
+
+# How many bytes of .dqc files to keep. Past that, the ones that were used
+#   longest ago are deleted, which is where entries for old versions of a
+#   script (or of the interpreter) end up, since nothing reads them any more.
+#
+LIMIT = 64 << 20
+
+# Every .dqc file starts with this, and then the key it was stored under,
+#   followed by the encoded trees, marshalled and compressed.
+#
+MAGIC = b"DQC\x01"
+
+# The trees depend on the lexer, the parser, and the optimizer, and the files
+#   on marshal's format, so a change to any of those invalidates every entry.
+#
+def _interpreter():
+    digest = hashlib.sha256(MAGIC)
+    digest.update(f"{sys.version} {marshal.version}".encode())
+    for module in (lexer, parser, optimizer):
+        with open(module.__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.digest()
+
+INTERPRETER = _interpreter()
+
+
+################################################################################
+
+
+# Flattens a list of trees into a list of tuples: each token becomes its
+#   fields, and each tree comes after its children, as its kind and how many
+#   children it has. (Trees can be nested far deeper than marshal or Python's
+#   stack allow, hence the flat list.)
+#
+def encode(trees):
+    out = []
+    stack = [(tree, False) for tree in reversed(trees)]
+    while stack:
+        node, ready = stack.pop()
+        if isinstance(node, Token):
+            out.append((node.txt, node.ln, node.col, node.val, node.cls))
+        elif ready:
+            out.append((node.kind, len(node.children)))
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+    return out
+
+
+def decode(items):
+    done = []
+    for item in items:
+        if len(item) == 5:
+            done.append(Token(*item))
+        else:
+            kind, n = item
+            children = done[len(done) - n:]
+            del done[len(done) - n:]
+            done.append(ParseTree(kind, children))
+    return done
+
+
+################################################################################
+
+
+# Returns the key for the script at the given path.
+#
+def key(path):
+    digest = hashlib.sha256(INTERPRETER)
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 16):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _entry(key):
+    return os.path.join(DIRECTORY, key.hex() + ".dqc")
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Returns the list of trees stored under the key, or None if there aren't any
+#   (or if the file doesn't hold what it should, in which case it's deleted).
+#
+def load(key):
+    path = _entry(key)
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+    header = MAGIC + key
+    try:
+        if not data.startswith(header):
+            raise ValueError("not a .dqc file for this key")
+        trees = decode(marshal.loads(zlib.decompress(data[len(header):])))
+    except (EOFError, ValueError, TypeError, IndexError, zlib.error):
+        _remove(path)
+        return None
+    try:
+        # (So that eviction knows it's been used.)
+        os.utime(path)
+    except OSError:
+        pass
+    return trees
+
+
+# Stores the list of trees under the key, and then evicts old entries. Like
+#   load, this never fails: a cache that can't be written to is just a cache
+#   that always misses.
+#
+def store(key, trees):
+    path = _entry(key)
+    temp = f"{path}.{os.getpid()}.tmp"
+    try:
+        data = zlib.compress(marshal.dumps(encode(trees)), 1)
+        os.makedirs(DIRECTORY, exist_ok=True)
+        with open(temp, 'wb') as file:
+            file.write(MAGIC + key + data)
+        os.replace(temp, path)
+    except (OSError, ValueError):
+        _remove(temp)
+        return
+    evict()
+
+
+# Deletes the entries that were used longest ago until the rest fit in limit.
+#
+def evict(limit = LIMIT):
+    entries = []
+    try:
+        with os.scandir(DIRECTORY) as found:
+            for entry in found:
+                if entry.name.endswith(".dqc"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        _remove(path)
+        total -= size
@@ -1,14 +1,139 @@
-from lexer  import Token, TokenStream
-from parser import ParseTree, ParseError, parse_line
+from lexer  import Token, TokenStream, LexError
+from parser import ParseTree, ParseError, parse_line, read_line, parse_tokens
+import optimizer
+from timeline import Timeline, UNTIMED
+import governor
+from governor import Governor, Exhausted
+from optimizer import MAX_CHAR
+from itertools import chain, islice
+from operator  import add
+from array     import array
+from types     import GeneratorType
+import re
+
+
+# The size of a queue that never runs out.
+Unbounded = float('inf')
+
+# How many elements the printers ask for at a time.
+BATCH = 4096
+
+# How many characters a Writer collects before passing them on.
+FLUSH_SIZE = 1 << 16
+
+
+# What's known about some queues without taking any of their elements: each
+#   of them has between lo and hi elements, and inner describes all of their
+#   elements together (None if nothing is known about those). If hollow is
+#   True, every one of the queues is hollow (see Queue.hollow).
+#
+class Shape:
+    __slots__ = ('lo', 'hi', 'hollow', 'inner')
+
+    def __init__(self, lo, hi, hollow, inner):
+        self.lo = lo
+        self.hi = hi
+        self.hollow = hollow
+        self.inner = inner
+
+    # Describes the queues described by either self or other.
+    def join(self, other):
+        if self is Void:
+            return other
+        if other is Void:
+            return self
+        if self.inner is None or other.inner is None:
+            inner = None
+        else:
+            inner = self.inner.join(other.inner)
+        return Shape(min(self.lo, other.lo), max(self.hi, other.hi),
+                     self.hollow and other.hollow, inner)
+
+    def __repr__(self):
+        return f"⟨\x1B[38;5;203mShape\x1B[39m {self.lo}..{self.hi}" + \
+               (" hollow" if self.hollow else "") + f" of {self.inner}⟩"
+
+# No queues at all, and queues with no elements.
+Void  = Shape(Unbounded, 0, True, None)
+Blank = Shape(0, 0, True, Void)
+
+
+# Multiplies two sizes, where no elements at all (like copies of an empty
+#   queue) beats Unbounded.
+#
+def _times(a, b):
+    return 0 if a == 0 or b == 0 else a * b
+
+
+# These two go down through the parts of a queue with a stack of their own
+#   instead of recursing, since queues can be nested far deeper than Python's
+#   stack allows.
+
+# Returns True if every queue that the given one leads to passes the test
+#   named by attr (like Queue._hollow). Each queue is only tested once,
+#   however many paths lead to it.
+#
+def _every(queue, attr):
+    verdict = getattr(queue, attr)()
+    if verdict is True or verdict is False:
+        return verdict
+    seen, stack = {queue}, list(verdict)
+    while stack:
+        q = stack.pop()
+        if q in seen:
+            continue
+        seen.add(q)
+        verdict = getattr(q, attr)()
+        if verdict is False:
+            return False
+        if verdict is not True:
+            stack.extend(verdict)
+    return True
+
+# Finishes working out a size from what _size or _count returned, which is
+#   either the size itself or a generator that's waiting on the sizes of
+#   other queues (see Queue._count). A generator can also yield a queue along
+#   with a set of its own to measure it with, instead of the shared one.
+#
+def _measure(size, seen):
+    stack = []
+    while True:
+        if type(size) is GeneratorType:
+            stack.append((size, seen))
+            size = None
+        elif not stack:
+            return size
+        count, seen = stack[-1]
+        try:
+            part = count.send(size)
+        except StopIteration as stop:
+            stack.pop()
+            size = stop.value
+            continue
+        if type(part) is tuple:
+            part, seen = part
+        size = part._size(seen)
 
 
 class Queue:
+    # Programs allocate queues by the million (every character taken from a
+    #   string is a new Natural), so no queue carries a __dict__; subclasses
+    #   list their fields in __slots__ instead.
+    __slots__ = ()
+
     def __init__(self):
         pass
 
     def copy(self):
         pass
 
+    # Promises that this queue will never be advanced again, only copied, so
+    #   that its copies can share its structure instead of duplicating it.
+    #   Everything reachable from the queue is frozen along with it. Returns
+    #   the queue itself.
+    def freeze(self):
+        return self
+
     def __iter__(self):
         return self
 
@@ -16,20 +141,145 @@ class Queue:
         pass
 
     def __len__(self):
+        # Like everything else, measuring a queue uses it up.
+        n = self.size()
+        if n is not None and n != Unbounded:
+            self._drain()
+            return n
         n = 0
+        limits = governor.active
         while True:
-            try:
-                next(self)
-                n += 1
-            except StopIteration:
-                break
-        return n
+            k = self.skip(BATCH)
+            n += k
+            limits.spend(k)
+            if k < BATCH:
+                return n
+
+    # Returns the number of elements left in the queue without consuming any
+    #   of them, Unbounded if the queue never runs out, or None if there's no
+    #   closed form (in which case the only way to find out is to iterate).
+    def size(self):
+        seen = set()
+        return _measure(self._size(seen), seen)
+
+    def _size(self, seen):
+        # A queue that appears more than once in the graph (like x in `x+x`)
+        #   gives its elements to whichever parent asks first, so counting
+        #   each appearance separately would be wrong.
+        if self in seen:
+            return None
+        seen.add(self)
+        return self._count(seen)
+
+    # Returns the size of the queue, or a generator that works it out (see
+    #   _measure), which yields each queue whose size it depends on and is
+    #   sent back that queue's _size in turn.
+    def _count(self, seen):
+        return None
+
+    # Returns a Shape describing just this queue, worked out without taking
+    #   any elements. Like size, a queue that's reached twice is unknown the
+    #   second time, because elements taken through one path are missing
+    #   from the other.
+    def shape(self):
+        try:
+            return self._shape(set())
+        except RecursionError:
+            # Too deeply nested to work out (like [[[[...]]]]), which is no
+            #   worse than not knowing.
+            return Shape(0, Unbounded, self.hollow(), None)
+
+    def _shape(self, seen):
+        if self in seen:
+            return Shape(0, Unbounded, self.hollow(), Blank if self.hollow() else None)
+        seen.add(self)
+        return self._outline(seen)
+
+    def _outline(self, seen):
+        size = _measure(self._count(seen), seen)
+        lo, hi = (0, Unbounded) if size is None else (size, size)
+        return Shape(lo, hi, self.hollow(), Blank if self.hollow() else None)
+
+    # Returns a queue that's as long as the next element, without taking it,
+    #   or None if there's no way to tell. (An empty queue stands in for the
+    #   next element of a queue that has run out.)
+    def _head(self):
+        return None
+
+    # Returns True if every element left in the queue is known to be empty.
+    def hollow(self):
+        return _every(self, '_hollow')
+
+    # Returns True or False if the queue can tell whether it's hollow by
+    #   itself, or else the queues that all have to be hollow for it to be
+    #   (which _every then looks at in turn). Queues that can always tell by
+    #   themselves set hollow = _hollow, since it's asked of every element
+    #   that gets printed.
+    def _hollow(self):
+        return False
+
+    # Returns True if the queue has run out for good, so that calling next()
+    #   on it again would do nothing but raise StopIteration (unlike e.g. a
+    #   zip whose second half ran out first, which still takes an element
+    #   from its first half every time it's asked). A parent can let go of
+    #   such a queue, and of everything it holds, by putting Nil in its place.
+    def _finished(self):
+        return False
+
+    # Returns the total size of the elements left in the queue, if that's
+    #   known without taking them, and taking them can't have any effect on
+    #   the rest of the program (so that it's safe to _drain the queue
+    #   without looking at them). Otherwise, returns None.
+    def _total(self):
+        return 0 if self.hollow() else None
+
+    # Returns a list of up to n elements, with the same effect as calling
+    #   next() n times; a shorter list means that the last call raised
+    #   StopIteration. Subclasses override this to hand over whole runs of
+    #   elements at once.
+    def next_batch(self, n):
+        out = []
+        try:
+            for _ in range(n):
+                out.append(next(self))
+        except StopIteration:
+            pass
+        return out
+
+    # Like next_batch, but returns how many elements there were instead.
+    def skip(self, n):
+        return len(self.next_batch(n))
+
+    # Returns True if every element the queue hands out is referenced by
+    #   nothing else, so that taking the next element can't change the
+    #   contents of one taken earlier (unlike e.g. `[y] + y`, where taking the
+    #   elements of y empties the first element). Elements of such a queue
+    #   can be taken in batches before they're looked at.
+    def fresh(self):
+        return _every(self, '_fresh')
+
+    # Like _hollow, for fresh.
+    def _fresh(self):
+        return False
+
+    # These two have the same effect as calling next() n times (all of which
+    #   succeed) or until StopIteration, respectively. Subclasses with a closed
+    #   form for their size override them to do that in constant time.
+    def _drop(self, n):
+        for _ in range(n):
+            next(self)
+
+    def _drain(self):
+        for _ in self:
+            pass
 
     def __repr__(self):
         return "⟨\x1B[38;5;203mQueue\x1B[39m⟩"
 
 
 class Empty(Queue):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -39,6 +289,37 @@ class Empty(Queue):
     def __next__(self):
         raise StopIteration
 
+    def _size(self, seen):
+        return 0
+
+    def _hollow(self):
+        return True
+
+    hollow = _hollow
+
+    def _finished(self):
+        return True
+
+    def _drop(self, n):
+        pass
+
+    def _drain(self):
+        pass
+
+    def next_batch(self, n):
+        return []
+
+    def skip(self, n):
+        return 0
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _shape(self, seen):
+        return Blank
+
     def __repr__(self):
         return "⟨\x1B[38;5;203mQueue\x1B[39m nil⟩"
 
@@ -47,33 +328,136 @@ Nil = Empty()
 
 
 class Literal(Queue):
+    __slots__ = ('list', 'index', 'shared')
+
     def __init__(self, lst):
         # Note that this is an actual list.
         self.list = lst
         self.index = 0
+        # Whether the elements of the list are frozen, in which case the list
+        #   can be shared between copies, as long as each of them hands out
+        #   copies of the elements instead of the elements themselves.
+        self.shared = False
 
     def copy(self):
-        return Literal([q.copy() for q in self.list[self.index:]])
+        if self.shared:
+            dup = Literal(self.list)
+            dup.index = self.index
+            dup.shared = True
+            return dup
+        # Literals nested in literals are copied with a stack rather than by
+        #   recursion, since they can be nested far deeper than Python's
+        #   stack allows.
+        dup = Literal(self.list[self.index:])
+        stack = [dup]
+        while stack:
+            lst = stack.pop().list
+            for i, q in enumerate(lst):
+                if type(q) is Literal and not q.shared:
+                    lst[i] = Literal(q.list[q.index:])
+                    stack.append(lst[i])
+                else:
+                    lst[i] = q.copy()
+        return dup
+
+    def freeze(self):
+        stack = [self]
+        while stack:
+            lit = stack.pop()
+            if lit.shared:
+                continue
+            lit.shared = True
+            for q in lit.list[lit.index:]:
+                if type(q) is Literal:
+                    stack.append(q)
+                else:
+                    q.freeze()
+        return self
 
     def __next__(self):
         if self.index < len(self.list):
             out = self.list[self.index]
+            if self.shared:
+                self.index += 1
+                return out.copy()
+            # The element belongs to whoever took it now, so the list lets go.
+            self.list[self.index] = Nil
             self.index += 1
             return out
         raise StopIteration
 
+    def _count(self, seen):
+        return len(self.list) - self.index
+
+    def _hollow(self):
+        # Only plain data, so that skipping the elements can't skip any side
+        #   effects that iterating over them would have had.
+        plain = (Empty, Literal, Natural, String, NaturalVector)
+        return all(isinstance(q, plain) and q.size() == 0
+                   for q in self.list[self.index:])
+
+    hollow = _hollow
+
+    def _finished(self):
+        return self.index >= len(self.list)
+
+    # Moves the cursor past the next n elements. Unless the list is shared
+    #   with copies, the literal won't look at those again, so it lets go of
+    #   them.
+    def _advance(self, n):
+        if not self.shared:
+            self.list[self.index:self.index+n] = [Nil] * n
+        self.index += n
+
+    def _drop(self, n):
+        self._advance(n)
+
+    def _drain(self):
+        self._advance(len(self.list) - self.index)
+
+    def next_batch(self, n):
+        out = self.list[self.index:self.index+n]
+        self._advance(len(out))
+        if self.shared:
+            return [q.copy() for q in out]
+        return out
+
+    def skip(self, n):
+        k = min(n, len(self.list) - self.index)
+        self._advance(k)
+        return k
+
+    def _fresh(self):
+        return self.shared
+
+    fresh = _fresh
+
+    def _head(self):
+        if self.index < len(self.list):
+            return self.list[self.index]
+        return Nil
+
+    def _outline(self, seen):
+        inner = Void
+        for q in self.list[self.index:]:
+            inner = inner.join(q._shape(seen))
+        size = len(self.list) - self.index
+        return Shape(size, size, self.hollow(), inner)
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
-        return f"⟨{q} literal = {self.list}⟩"
+        return f"⟨{q} literal = {self.list[self.index:]}⟩"
 
 
 class Natural(Queue):
+    __slots__ = ('value', 'index')
+
     def __init__(self, nat):
         self.value = nat
         self.index = 0
 
     def copy(self):
-        return Natural(self.value - self.index)
+        return Natural(self.value - self.index) if self.index < self.value else Nil
 
     def __next__(self):
         if self.index < self.value:
@@ -81,18 +465,64 @@ class Natural(Queue):
             return Nil
         raise StopIteration
 
+    def __len__(self):
+        # (The common case when printing strings, so skip the general path.)
+        n = self.value - self.index
+        self.index = self.value
+        return n
+
+    def _count(self, seen):
+        return self.value - self.index
+
+    def _hollow(self):
+        return True
+
+    hollow = _hollow
+
+    def _finished(self):
+        return self.index >= self.value
+
+    def _drop(self, n):
+        self.index += n
+
+    def _drain(self):
+        self.index = self.value
+
+    def next_batch(self, n):
+        return [Nil] * self.skip(n)
+
+    def skip(self, n):
+        k = min(n, self.value - self.index)
+        self.index += k
+        return k
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _head(self):
+        return Nil
+
+    def _outline(self, seen):
+        size = self.value - self.index
+        return Shape(size, size, True, Blank if size else Void)
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} natural = {self.value}⟩"
 
 
 class String(Queue):
-    def __init__(self, string):
+    __slots__ = ('value', 'index')
+
+    def __init__(self, string, index = 0):
         self.value = string
-        self.index = 0
+        self.index = index
 
     def copy(self):
-        return String(self.value[self.index:])
+        # Strings are immutable, so the copy can share this one's value.
+        return String(self.value, self.index)
 
     def __next__(self):
         if self.index < len(self.value):
@@ -101,16 +531,133 @@ class String(Queue):
             return out
         raise StopIteration
 
+    def _count(self, seen):
+        return len(self.value) - self.index
+
+    def _total(self):
+        return sum(map(ord, self.value[self.index:]))
+
+    def _finished(self):
+        return self.index >= len(self.value)
+
+    def _drop(self, n):
+        self.index += n
+
+    def _drain(self):
+        self.index = len(self.value)
+
+    def next_batch(self, n):
+        out = [Natural(ord(c)) for c in self.value[self.index:self.index+n]]
+        self.index += len(out)
+        return out
+
+    def skip(self, n):
+        k = min(n, len(self.value) - self.index)
+        self.index += k
+        return k
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _head(self):
+        if self.index < len(self.value):
+            return Natural(ord(self.value[self.index]))
+        return Nil
+
+    def _outline(self, seen):
+        rest = self.value[self.index:]
+        if not rest:
+            return Shape(0, 0, False, Void)
+        inner = Shape(ord(min(rest)), ord(max(rest)), True, Blank)
+        return Shape(len(rest), len(rest), False, inner)
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} string = {self.value}⟩"
 
 
+class NaturalVector(Queue):
+    # A run of naturals packed into an array, standing in for a literal like
+    #   [3, 1, 4, 1, 5] without keeping a Natural around for each of them.
+    #   Like a String, it hands out a fresh Natural for every element.
+    __slots__ = ('values', 'index')
+
+    def __init__(self, values, index = 0):
+        # Note that this is an array('Q'), which is never modified.
+        self.values = values
+        self.index = index
+
+    def copy(self):
+        return NaturalVector(self.values, self.index)
+
+    def __next__(self):
+        if self.index < len(self.values):
+            out = Natural(self.values[self.index])
+            self.index += 1
+            return out
+        raise StopIteration
+
+    def _count(self, seen):
+        return len(self.values) - self.index
+
+    def _total(self):
+        return sum(self.values[self.index:])
+
+    def _outline(self, seen):
+        rest = self.values[self.index:]
+        if not rest:
+            return Shape(0, 0, True, Void)
+        inner = Shape(min(rest), max(rest), True, Blank)
+        return Shape(len(rest), len(rest), self.hollow(), inner)
+
+    def _hollow(self):
+        return not any(self.values[self.index:])
+
+    hollow = _hollow
+
+    def _finished(self):
+        return self.index >= len(self.values)
+
+    def _drop(self, n):
+        self.index += n
+
+    def _drain(self):
+        self.index = len(self.values)
+
+    def next_batch(self, n):
+        out = [Natural(v) for v in self.values[self.index:self.index+n]]
+        self.index += len(out)
+        return out
+
+    def skip(self, n):
+        k = min(n, len(self.values) - self.index)
+        self.index += k
+        return k
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _head(self):
+        if self.index < len(self.values):
+            return Natural(self.values[self.index])
+        return Nil
+
+    def __repr__(self):
+        q = "\x1B[38;5;203mQueue\x1B[39m"
+        return f"⟨{q} vector = {list(self.values[self.index:])}⟩"
+
+
 class SafeFactory(Queue):
     # A SafeFactory saves a copy of the template
     #   and then returns duplicates of that.
+    __slots__ = ('queue',)
+
     def __init__(self, queue):
-        self.queue = queue.copy()
+        self.queue = queue.copy().freeze()
 
     def copy(self):
         return self
@@ -118,6 +665,24 @@ class SafeFactory(Queue):
     def __next__(self):
         return self.queue.copy()
 
+    def _size(self, seen):
+        return Unbounded
+
+    def _drop(self, n):
+        pass
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _head(self):
+        return self.queue
+
+    def _outline(self, seen):
+        copy = self.queue._shape(seen)
+        return Shape(Unbounded, Unbounded, False, copy)
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} factory = {self.queue}⟩"
@@ -127,6 +692,8 @@ class UnsafeFactory(Queue):
     # An UnsafeFactory returns duplicates of
     #   the template in its current state,
     #   even if the template has changed.
+    __slots__ = ('queue',)
+
     def __init__(self, queue):
         self.queue = queue
 
@@ -136,31 +703,217 @@ class UnsafeFactory(Queue):
     def __next__(self):
         return self.queue.copy()
 
+    def _size(self, seen):
+        return Unbounded
+
+    def _drop(self, n):
+        pass
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} factory = {self.queue}⟩"
 
 
 class Concat(Queue):
-    def __init__(self, fst, snd):
-        self.fst = fst
-        self.snd = snd
+    # A Concat is a rope: a flat list of parts and a cursor to the one that's
+    #   currently being read, so that a+b+c+... costs the same per element
+    #   however many parts there are. Concats passed to the constructor are
+    #   merged into it rather than nested.
+    __slots__ = ('parts', 'index', 'spent', 'thawed')
+
+    def __init__(self, *queues):
+        self.parts = []
+        for q in queues:
+            if isinstance(q, Concat):
+                self.parts += q._live()
+            else:
+                self.parts.append(q)
+        self.index = 0
+        # Exhausted parts that haven't run out for good (see _finished). Every
+        #   call to next() still calls next() on these first, since that may
+        #   have side effects on queues that are shared with the rest of the
+        #   program. Parts that have run out for good are replaced with Nil,
+        #   so that nothing they held stays reachable.
+        self.spent = []
+        # Parts from here on are frozen templates shared with other Concats,
+        #   and each is copied when the cursor first reaches it.
+        self.thawed = len(self.parts)
 
     def copy(self):
-        return Concat(self.fst.copy(), self.snd.copy())
+        dup = Concat()
+        dup.spent = [q.copy() for q in self.spent if not q._finished()]
+        dup.parts = self.parts[self.index:]
+        dup.thawed = max(self.thawed - self.index, 0)
+        for i in range(dup.thawed):
+            dup.parts[i] = dup.parts[i].copy()
+        return dup
+
+    def freeze(self):
+        for q in self.spent + self.parts[self.index:self.thawed]:
+            q.freeze()
+        self.thawed = min(self.thawed, self.index)
+        return self
 
     def __next__(self):
-        try:
-            return next(self.fst)
-        except StopIteration:
-            return next(self.snd)
+        if self.spent:
+            for q in self.spent:
+                try:
+                    return next(q)
+                except StopIteration:
+                    pass
+            self.spent = [q for q in self.spent if not q._finished()]
+        parts = self.parts
+        while self.index < len(parts):
+            if self.index >= self.thawed:
+                parts[self.index] = parts[self.index].copy()
+                self.thawed = self.index + 1
+            try:
+                return next(parts[self.index])
+            except StopIteration:
+                self._retire()
+        raise StopIteration
+
+    # Moves the cursor past the part under it, which has just run out.
+    def _retire(self):
+        part = self.parts[self.index]
+        if not part._finished():
+            self.spent.append(part)
+        self.parts[self.index] = Nil
+        self.index += 1
+
+    # Returns the part under the cursor, after copying it if it's still a
+    #   template, since the caller is about to advance it.
+    def _current(self):
+        if self.index >= self.thawed:
+            self.parts[self.index] = self.parts[self.index].copy()
+            self.thawed = self.index + 1
+        return self.parts[self.index]
+
+    # Takes an element from the parts from the cursor on, as __next__ does
+    #   once it's done asking the spent parts.
+    def _step(self):
+        while self.index < len(self.parts):
+            try:
+                return next(self._current())
+            except StopIteration:
+                self._retire()
+        raise StopIteration
+
+    # The call to next() that finds a part empty goes on to the parts after
+    #   it, but every call after that asks the spent parts again first, so
+    #   once there are any, these two go one element at a time.
+
+    def next_batch(self, n):
+        if self.spent:
+            return Queue.next_batch(self, n)
+        out = []
+        while self.index < len(self.parts):
+            out += self._current().next_batch(n - len(out))
+            if len(out) == n:
+                return out
+            self._retire()
+            if self.spent:
+                try:
+                    out.append(self._step())
+                except StopIteration:
+                    return out
+                return out + Queue.next_batch(self, n - len(out))
+        return out
+
+    def skip(self, n):
+        if self.spent:
+            return Queue.skip(self, n)
+        k = 0
+        while self.index < len(self.parts):
+            k += self._current().skip(n - k)
+            if k == n:
+                return k
+            self._retire()
+            if self.spent:
+                try:
+                    self._step()
+                except StopIteration:
+                    return k
+                return k + 1 + Queue.skip(self, n - k - 1)
+        return k
+
+    def _fresh(self):
+        return self.spent + self.parts[self.index:]
+
+    # Returns the parts that haven't been skipped for good, after copying any
+    #   that are still templates, since the caller is about to advance them.
+    def _live(self):
+        for i in range(max(self.thawed, self.index), len(self.parts)):
+            self.parts[i] = self.parts[i].copy()
+        self.thawed = len(self.parts)
+        return self.spent + self.parts[self.index:]
+
+    def _count(self, seen):
+        total = 0
+        for q in self.spent + self.parts[self.index:]:
+            size = yield q
+            if size is None:
+                return None
+            total += size
+        return total
+
+    def _hollow(self):
+        return self.spent + self.parts[self.index:]
+
+    def _finished(self):
+        return not self.spent and self.index >= len(self.parts)
+
+    # A part that runs out without having run out for good (like a zip whose
+    #   second half is empty) is asked again for every element after it, so
+    #   draining it once isn't the same as iterating past it. Returns True if
+    #   there's no such part before the last.
+    def _settled(self):
+        parts = self._live()
+        return all(q._finished() or isinstance(q, Inert) for q in parts[:-1])
+
+    def _drop(self, n):
+        for q in self._live():
+            size = q.size()
+            if n <= size:
+                q._drop(n)
+                return
+            if not (q._finished() or isinstance(q, Inert)):
+                return Queue._drop(self, n)
+            q._drain()
+            n -= size
+
+    def _drain(self):
+        # (Iterating until the parts that keep being asked have run out for
+        #   good, if they ever do before the end.)
+        while not self._settled():
+            if self.skip(BATCH) < BATCH:
+                return
+        for q in self._live():
+            q._drain()
+
+    def _outline(self, seen):
+        lo, hi, inner = 0, 0, Void
+        for q in self.spent + self.parts[self.index:]:
+            part = q._shape(seen)
+            lo, hi = lo + part.lo, hi + part.hi
+            inner = None if inner is None or part.inner is None \
+                         else inner.join(part.inner)
+        return Shape(lo, hi, self.hollow(), inner)
 
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
-        return f"⟨{q} concat = {self.fst} + {self.snd}⟩"
+        parts = " + ".join(str(q) for q in self.spent + self.parts[self.index:])
+        return f"⟨{q} concat = {parts}⟩"
 
 
 class Zip(Queue):
+    __slots__ = ('fst', 'snd')
+
     def __init__(self, fst, snd):
         self.fst = fst
         self.snd = snd
@@ -168,6 +921,11 @@ class Zip(Queue):
     def copy(self):
         return Zip(self.fst.copy(), self.snd.copy())
 
+    def freeze(self):
+        self.fst.freeze()
+        self.snd.freeze()
+        return self
+
     def __next__(self):
         # Instead of
         #
@@ -182,12 +940,62 @@ class Zip(Queue):
         out_snd = next(self.snd)
         return Concat(out_fst, out_snd)
 
+    def _count(self, seen):
+        fst = yield self.fst
+        snd = yield self.snd
+        if fst is None or snd is None:
+            return None
+        return min(fst, snd)
+
+    def _hollow(self):
+        return (self.fst, self.snd)
+
+    def _finished(self):
+        # Once self.fst has run out for good, self.snd is never asked again.
+        return self.fst._finished()
+
+    def _drop(self, n):
+        self.fst._drop(n)
+        self.snd._drop(n)
+
+    def _drain(self):
+        fst, snd = self.fst.size(), self.snd.size()
+        if fst > snd:
+            # The last call to next() takes an element from self.fst
+            #   before discovering that self.snd is empty.
+            self.fst._drop(snd + 1)
+            self.snd._drain()
+        else:
+            self.fst._drain()
+            self.snd._drop(fst)
+
+    def _fresh(self):
+        return (self.fst, self.snd)
+
+    def _outline(self, seen):
+        fst = self.fst._shape(seen)
+        snd = self.snd._shape(seen)
+        lo, hi = min(fst.lo, snd.lo), min(fst.hi, snd.hi)
+        if fst.inner is Void or snd.inner is Void:
+            inner = Void
+        elif fst.inner is None or snd.inner is None:
+            inner = None
+        else:
+            # Each element is the concatenation of an element from either side.
+            a, b = fst.inner, snd.inner
+            inner = Shape(a.lo + b.lo, a.hi + b.hi, a.hollow and b.hollow,
+                          None if a.inner is None or b.inner is None
+                               else a.inner.join(b.inner))
+        return Shape(lo, hi, self.hollow(), inner)
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} zip = {self.fst} ~ {self.snd}⟩"
 
 
 class Flatten(Queue):
+    __slots__ = ('queue', 'current')
+
     def __init__(self, queue):
         self.queue = queue
         self.current = Nil
@@ -195,24 +1003,410 @@ class Flatten(Queue):
     def copy(self):
         return Flatten(self.queue.copy())
 
+    def freeze(self):
+        self.queue.freeze()
+        self.current.freeze()
+        return self
+
+    # Flattens nested in each other (like ___[[[x]]], through either link)
+    #   would recurse once per level, so this goes down through them with a
+    #   stack of its own. Each frame holds a Flatten and whether it's waiting
+    #   on its queue or on its current element.
     def __next__(self):
-        while True:
+        stack = []
+        flat, waiting = self, False
+        if type(self.current) is not Flatten:
+            # (The usual case, where the element at hand has more to give.)
             try:
                 return next(self.current)
             except StopIteration:
-                # We intentionally don't catch any StopIteration
-                #   exceptions that self.queue.__next__() might throw,
-                #   like we do in Zip's `next` method.
+                waiting = True
+        while True:
+            q = flat.queue if waiting else flat.current
+            if type(q) is Flatten:
+                stack.append((flat, waiting))
+                flat, waiting = q, False
+                continue
+            try:
+                elem = next(q)
+            except StopIteration:
+                elem = None
+            # Hand what came out back up, until a Flatten has more to ask.
+            while True:
+                if elem is None and not waiting:
+                    waiting = True
+                    break
+                if elem is not None and waiting:
+                    flat.current = elem
+                    waiting = False
+                    break
+                if elem is None:
+                    flat._release()
+                if not stack:
+                    if elem is None:
+                        raise StopIteration
+                    return elem
+                flat, waiting = stack.pop()
+
+    def next_batch(self, n):
+        out = []
+        while True:
+            if type(self.current) is Flatten:
+                # (Taken one at a time, as above.)
+                return out + Queue.next_batch(self, n - len(out))
+            out += self.current.next_batch(n - len(out))
+            if len(out) == n:
+                return out
+            try:
+                self.current = next(self.queue)
+            except StopIteration:
+                self._release()
+                return out
+
+    def skip(self, n):
+        k = 0
+        while True:
+            if type(self.current) is Flatten:
+                return k + Queue.skip(self, n - k)
+            k += self.current.skip(n - k)
+            if k == n:
+                return k
+            try:
                 self.current = next(self.queue)
+            except StopIteration:
+                self._release()
+                return k
+
+    # Called when self.queue runs out, to let go of it and of the last
+    #   element if they've run out for good.
+    def _release(self):
+        if self.current._finished():
+            self.current = Nil
+        if self.queue._finished():
+            self.queue = Nil
+
+    def _finished(self):
+        stack = [self]
+        while stack:
+            q = stack.pop()
+            if type(q) is Flatten:
+                stack += (q.queue, q.current)
+            elif not q._finished():
+                return False
+        return True
+
+    def _count(self, seen):
+        current = yield self.current
+        if current is None or (yield self.queue) is None:
+            return None
+        total = self.queue._total()
+        return None if total is None else current + total
+
+    def _drain(self):
+        if self.queue._total() is None:
+            return Queue._drain(self)
+        self.current._drain()
+        self.current = Nil
+        self.queue._drain()
+        self._release()
+
+    def _fresh(self):
+        return (self.queue,)
+
+    def _outline(self, seen):
+        current = self.current._shape(seen)
+        queue = self.queue._shape(seen)
+        elems = queue.inner
+        if elems is None:
+            lo, hi = current.lo, (current.hi if queue.hi == 0 else Unbounded)
+            return Shape(lo, hi, False, None)
+        lo = current.lo + _times(queue.lo, elems.lo)
+        hi = current.hi + _times(queue.hi, elems.hi)
+        if elems is Void:
+            return Shape(lo, hi, current.hollow, current.inner)
+        hollow = current.hollow and elems.hollow
+        inner = None if current.inner is None or elems.inner is None \
+                     else current.inner.join(elems.inner)
+        return Shape(lo, hi, hollow, inner)
 
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} flatten = {self.queue}⟩"
 
 
+class Repeat(Queue):
+    # a*b is syntactic sugar for _(b~$a), but instead of building that, a
+    #   Repeat walks through b and follows each of its elements with a copy
+    #   of a, without allocating a Concat for every element on the way.
+    __slots__ = ('template', 'queue', 'elem', 'current')
+
+    def __init__(self, template, queue):
+        self.template = template.copy().freeze()
+        self.queue = queue
+        # The element of self.queue that's being read (or None, once it's
+        #   known to be empty for good), and then the copy of the template
+        #   that goes after it.
+        self.elem = None
+        self.current = Nil
+
+    def copy(self):
+        # Like Flatten, the copy starts over with the next element.
+        dup = type(self)(Nil, self.queue.copy())
+        dup.template = self.template
+        return dup
+
+    def freeze(self):
+        self.queue.freeze()
+        self.current.freeze()
+        if self.elem is not None:
+            self.elem.freeze()
+        return self
+
+    def __next__(self):
+        while True:
+            if self.elem is not None:
+                try:
+                    return next(self.elem)
+                except StopIteration:
+                    if self.elem._finished():
+                        self.elem = None
+            try:
+                return next(self.current)
+            except StopIteration:
+                pass
+            elem = next(self.queue)
+            # Most of the time, b is a natural and elem is Nil.
+            self.elem = None if elem is Nil else elem
+            self.current = self.template.copy()
+
+    def next_batch(self, n):
+        out = []
+        while len(out) < n:
+            if self.elem is not None:
+                try:
+                    out.append(next(self))
+                except StopIteration:
+                    return out
+                continue
+            out += self.current.next_batch(n - len(out))
+            if len(out) == n:
+                return out
+            try:
+                elem = next(self.queue)
+            except StopIteration:
+                return out
+            self.elem = None if elem is Nil else elem
+            self.current = self.template.copy()
+        return out
+
+    def skip(self, n):
+        k = 0
+        while k < n:
+            if self.elem is not None:
+                try:
+                    next(self)
+                    k += 1
+                except StopIteration:
+                    return k
+                continue
+            k += self.current.skip(n - k)
+            if k == n:
+                return k
+            try:
+                elem = next(self.queue)
+            except StopIteration:
+                return k
+            self.elem = None if elem is Nil else elem
+            self.current = self.template.copy()
+        return k
+
+    def _fresh(self):
+        # Copies of the template are fresh, and so is anything in them.
+        return (self.queue,)
+
+    def _count(self, seen):
+        # Only when the sizes of b's elements add up to a known total (like
+        #   when they're all empty, or b is a string), since each of them is
+        #   followed by exactly one copy of a.
+        total = self.queue._total()
+        if total is None:
+            return None
+        # (The template and the current copy of it are measured on their
+        #   own, like size() would.)
+        each  = yield self.template, set()
+        times = yield self.queue
+        left  = yield self.current, set()
+        if self.elem is not None:
+            elem = yield self.elem
+            left = None if elem is None or left is None else elem + left
+        if each is None or times is None or left is None:
+            return None
+        if times == 0:
+            return left
+        if times == Unbounded:
+            # If a is empty too, next() never returns at all.
+            return Unbounded if each > 0 else None
+        return left + total + times * each
+
+    def _hollow(self):
+        parts = (self.template, self.current, self.queue)
+        return parts if self.elem is None else parts + (self.elem,)
+
+    def _finished(self):
+        return self.current._finished() and self.queue._finished() and \
+               (self.elem is None or self.elem._finished())
+
+    def _drain(self):
+        if self.elem is not None:
+            self.elem._drain()
+        self.current._drain()
+        self.queue._drain()
+
+    def _outline(self, seen):
+        # The elements come from the element being read, the current copy
+        #   of the template, and then from each element of b followed by a
+        #   copy of the template.
+        template = self.template._shape(seen)
+        current = self.current._shape(seen)
+        queue = self.queue._shape(seen)
+        parts = [current]
+        if self.elem is not None:
+            parts.append(self.elem._shape(seen))
+        lo, hi = sum(p.lo for p in parts), sum(p.hi for p in parts)
+        elems = queue.inner or Shape(0, Unbounded, False, None)
+        if elems is not Void:
+            lo += _times(queue.lo, elems.lo + template.lo)
+            hi += _times(queue.hi, elems.hi + template.hi)
+            parts += [elems, template]
+        inner = Void
+        for p in parts:
+            inner = None if inner is None or p.inner is None else inner.join(p.inner)
+        return Shape(lo, hi, self.hollow(), inner)
+
+    def __repr__(self):
+        q = "\x1B[38;5;203mQueue\x1B[39m"
+        return f"⟨{q} star = {self.template} * {self.queue}⟩"
+
+
+class StringRepeat(Repeat):
+    # "abc"*b, where reading straight from the current copy of the string
+    #   saves a method call for every element.
+    __slots__ = ()
+
+    def __init__(self, template, queue):
+        Repeat.__init__(self, template, queue)
+        self.current = String("")
+
+    def __next__(self):
+        current = self.current
+        if self.elem is None and current.index < len(current.value):
+            out = Natural(ord(current.value[current.index]))
+            current.index += 1
+            return out
+        return Repeat.__next__(self)
+
+
+class Head(Queue):
+    # ^x is syntactic sugar for _(1~x): the elements of the first element of
+    #   x. Like the sugar, a Head takes that element the first time it's
+    #   asked for one, and then asks that element every time after.
+    __slots__ = ('queue', 'current')
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.current = None
+
+    def copy(self):
+        if self.current is None:
+            return Head(self.queue.copy())
+        # The copy of the 1 in _(1~x) would be empty by now.
+        return Nil
+
+    def freeze(self):
+        self.queue.freeze()
+        if self.current is not None:
+            self.current.freeze()
+        return self
+
+    def _take(self):
+        # If x turns out to be empty, there's nothing left to ask.
+        self.current = Nil
+        try:
+            self.current = next(self.queue)
+        except StopIteration:
+            pass
+        # Either way, x is never asked again.
+        self.queue = Nil
+
+    def __next__(self):
+        if self.current is None:
+            self._take()
+        return next(self.current)
+
+    def next_batch(self, n):
+        if self.current is None:
+            self._take()
+        return self.current.next_batch(n)
+
+    def skip(self, n):
+        if self.current is None:
+            self._take()
+        return self.current.skip(n)
+
+    def _fresh(self):
+        return (self.queue if self.current is None else self.current,)
+
+    def _finished(self):
+        return self.current is not None and self.current._finished()
+
+    def _count(self, seen):
+        if self.current is None:
+            # Which element comes first depends on whether x is read from
+            #   anywhere else first.
+            if self.queue in seen:
+                return None
+            seen.add(self.queue)
+            head = self.queue._head()
+            return None if head is None else (yield head)
+        return (yield self.current)
+
+    def _hollow(self):
+        if self.current is None:
+            head = self.queue._head()
+            return False if head is None else (head,)
+        return (self.current,)
+
+    def _drop(self, n):
+        if self.current is None:
+            self._take()
+        self.current._drop(n)
+
+    def _drain(self):
+        if self.current is None:
+            self._take()
+        self.current._drain()
+
+    def _outline(self, seen):
+        if self.current is None:
+            if self.queue in seen:
+                return Queue._outline(self, seen)
+            seen.add(self.queue)
+            head = self.queue._head()
+            if head is None:
+                return Queue._outline(self, seen)
+            return head._shape(seen)
+        return self.current._shape(seen)
+
+    def __repr__(self):
+        q = "\x1B[38;5;203mQueue\x1B[39m"
+        return f"⟨{q} head = {self.queue}⟩"
+
+
 class Take(Queue):
     # This kind of queue exists for debugging purposes
 
+    __slots__ = ('queue', 'index', 'halted')
+
     def __init__(self, queue, N):
         self.queue = queue
         self.index = N
@@ -223,6 +1417,10 @@ class Take(Queue):
         dup.halted = self.halted
         return dup
 
+    def freeze(self):
+        self.queue.freeze()
+        return self
+
     def __next__(self):
         if self.index > 0:
             self.index -= 1
@@ -235,81 +1433,560 @@ class Take(Queue):
         self.halted = True
         raise StopIteration
 
+    def _count(self, seen):
+        size = yield self.queue
+        if size is None:
+            return None
+        return min(self.index, size)
+
+    def _hollow(self):
+        return (self.queue,)
+
+    def _finished(self):
+        return self.queue._finished()
+
+    def _drop(self, n):
+        self.queue._drop(n)
+        self.index -= n
+
+    def _drain(self):
+        size = self.queue.size()
+        n = min(self.index, size)
+        self._drop(n)
+        if size > n:
+            self.queue._drop(1)
+            self.halted = True
+        else:
+            self.queue._drain()
+
+    def next_batch(self, n):
+        k = min(n, self.index)
+        out = self.queue.next_batch(k)
+        self.index -= len(out)
+        if len(out) == k < n:
+            # Out of budget, but the caller wants more, so do the check
+            #   in __next__ to see whether we stopped early.
+            try:
+                out.append(next(self))
+            except StopIteration:
+                pass
+        return out
+
+    def skip(self, n):
+        k = min(n, self.index)
+        done = self.queue.skip(k)
+        self.index -= done
+        if done == k < n:
+            try:
+                next(self)
+                done += 1
+            except StopIteration:
+                pass
+        return done
+
+    def _fresh(self):
+        return (self.queue,)
+
+    def _outline(self, seen):
+        queue = self.queue._shape(seen)
+        return Shape(min(self.index, queue.lo), min(self.index, queue.hi),
+                     queue.hollow, queue.inner)
+
     def __repr__(self):
         q = "\x1B[38;5;203mQueue\x1B[39m"
         return f"⟨{q} take = {self.queue}⟩"
 
 
+class Input:
+    # The text that get, getNum, and getStr read: a file, or stdin if it's
+    #   None. It's read CHUNK_SIZE characters at a time, as they're needed, so
+    #   only one chunk is held at once (besides the number or line that's
+    #   being read, if it runs on past the end of the chunk).
+    def __init__(self, file = None):
+        self.file = file
+        self.text = ""
+        self.pos  = 0           # everything before this has been read
+        self.done = False
+
+    # Reads the next chunk. Returns False at the end of the input.
+    def _fill(self):
+        if self.done:
+            return False
+        if self.file is None:
+            from sys import stdin
+            self.file = stdin
+        chunk = self.file.read(CHUNK_SIZE)
+        if not chunk:
+            self.done = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # Returns True once everything has been read. (Without reading any more to
+    #   find out, since that could mean waiting for someone to type it.)
+    def finished(self):
+        return self.done and self.pos == len(self.text)
+
+    # Returns the next n characters, or fewer at the end of the input.
+    def chars(self, n):
+        out = []
+        while n > 0 and (self.pos < len(self.text) or self._fill()):
+            piece = self.text[self.pos:self.pos+n]
+            self.pos += len(piece)
+            n -= len(piece)
+            out.append(piece)
+        return "".join(out)
+
+    # Returns the next run of digits as a number, skipping anything else, or
+    #   None at the end of the input.
+    def number(self):
+        digits = []
+        while self.pos < len(self.text) or self._fill():
+            if digits:
+                # (The number went up to the end of the last chunk.)
+                match = DIGITS.match(self.text, self.pos)
+                if match is None:
+                    break
+            else:
+                match = DIGITS.search(self.text, self.pos)
+                if match is None:
+                    self.pos = len(self.text)
+                    continue
+            digits.append(match.group())
+            self.pos = match.end()
+            if self.pos < len(self.text):
+                break
+        return int("".join(digits)) if digits else None
+
+    # Returns up to n numbers, as from calling number() n times.
+    def numbers(self, n):
+        out = []
+        while len(out) < n:
+            # The numbers that end before the end of the chunk are read all at
+            #   once, and number() takes care of one that might run on.
+            end = len(self.text)
+            for match in DIGITS.finditer(self.text, self.pos):
+                if match.end() == end or len(out) == n:
+                    break
+                out.append(int(match.group()))
+                self.pos = match.end()
+            else:
+                self.pos = end
+            if len(out) == n:
+                break
+            number = self.number()
+            if number is None:
+                break
+            out.append(number)
+        return out
+
+    # Returns the next line, without its newline, or None at the end of the
+    #   input.
+    def line(self):
+        parts = []
+        while self.pos < len(self.text) or self._fill():
+            end = self.text.find("\n", self.pos)
+            if end >= 0:
+                parts.append(self.text[self.pos:end])
+                self.pos = end + 1
+                return "".join(parts)
+            parts.append(self.text[self.pos:])
+            self.pos = len(self.text)
+        return "".join(parts) if parts else None
+
+DIGITS = re.compile(r"[0-9]+")
+
+
+# The queues for get, getNum, and getStr. Each of them reads what's left of the
+#   input, so whatever one of them takes is gone for the rest, and that goes
+#   for their copies too, since a copy that could replay the input would have
+#   to hold on to all of it.
+
+class InputString(Queue):
+    # getStr: the rest of the input as a string. Like a String, it hands out a
+    #   fresh Natural for every character.
+    __slots__ = ('input',)
+
+    def __init__(self, input):
+        self.input = input
+
+    def copy(self):
+        return self
+
+    def __next__(self):
+        char = self.input.chars(1)
+        if char:
+            return Natural(ord(char))
+        raise StopIteration
+
+    def next_batch(self, n):
+        return [Natural(ord(c)) for c in self.input.chars(n)]
+
+    def skip(self, n):
+        return len(self.input.chars(n))
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _finished(self):
+        return self.input.finished()
+
+    def __repr__(self):
+        q = "\x1B[38;5;203mQueue\x1B[39m"
+        return f"⟨{q} getStr⟩"
+
+
+class InputNumbers(Queue):
+    # getNum: a natural for every run of digits in the rest of the input, with
+    #   anything between them skipped.
+    __slots__ = ('input',)
+
+    def __init__(self, input):
+        self.input = input
+
+    def copy(self):
+        return self
+
+    def __next__(self):
+        n = self.input.number()
+        if n is None:
+            raise StopIteration
+        return Natural(n) if n else Nil
+
+    def next_batch(self, n):
+        return [Natural(k) if k else Nil for k in self.input.numbers(n)]
+
+    def skip(self, n):
+        return len(self.input.numbers(n))
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _finished(self):
+        return self.input.finished()
+
+    def __repr__(self):
+        q = "\x1B[38;5;203mQueue\x1B[39m"
+        return f"⟨{q} getNum⟩"
+
+
+class InputLines(Queue):
+    # get: a string for every line in the rest of the input.
+    __slots__ = ('input',)
+
+    def __init__(self, input):
+        self.input = input
+
+    def copy(self):
+        return self
+
+    def __next__(self):
+        line = self.input.line()
+        if line is None:
+            raise StopIteration
+        return String(line)
+
+    def _fresh(self):
+        return True
+
+    fresh = _fresh
+
+    def _finished(self):
+        return self.input.finished()
+
+    def __repr__(self):
+        q = "\x1B[38;5;203mQueue\x1B[39m"
+        return f"⟨{q} get⟩"
+
+
+# Once one of these runs out, calling next() on it again does nothing but
+#   raise StopIteration, so there's no need to keep asking.
+#
+Inert = (Empty, Literal, Natural, String, NaturalVector)
+
+
 ################################################################################
 
 GLOBALS = {}
 
+# Where get, getNum, and getStr read from.
+#
+INPUT = Input()
+
+# The limits on what printing a line can cost (see governor.py): how many
+#   elements can be taken, how many seconds it can take, and how many bytes
+#   the process can grow by. Printing stops with a warning once one trips.
+#
+GOVERNOR = Governor(steps=1 << 26, seconds=60, memory=1 << 30)
+
+# The tighter limits for what's printed without a print command (a line
+#   that's just an expression) or at the prompt, where a line is most likely
+#   to be infinite by accident. The steps are in line with the million
+#   elements that such lines used to be cut off at.
+#
+PREVIEW = Governor(steps=1 << 20, seconds=60, memory=1 << 30)
+
+# Set PROFILE = True (or enter `:profile on` at the prompt) to have the REPL
+#   count what the queues of each line do; `:profile` then shows the counts
+#   for the last line. See profiler.py.
+#
+PROFILE = False
+
 # Token: 'natural', 'string', 'name', 'keyword'
-# ParseTree: 'literal', 'factory', 'flatten', 'zip', 'concat'
+# ParseTree: 'literal', 'factory', 'take', 'flatten', 'zip', 'star', 'concat'
+
+def makeLeaf(node):
+    if node.cls == "natural":
+        # Nothing can be taken from an empty natural, so it might as well
+        #   be the shared empty queue.
+        return Natural(node.val) if node.val else Nil
+    elif node.cls == "string":
+        return String(node.val)
+    elif node.cls == "name":
+        if node.val in GLOBALS:
+            return GLOBALS[node.val]
+        else:
+            return Nil
+    elif node.cls == "keyword":
+        if node.val == 'get':
+            return InputLines(INPUT)
+        elif node.val == 'getNum':
+            return InputNumbers(INPUT)
+        elif node.val == 'getStr':
+            return InputString(INPUT)
+        else:
+            return Nil
+    else:
+        raise NotImplementedError(str(node))
+
+
+# Returns the trees that the queue for the given tree is built out of.
+#
+def operands(node):
+    if node.kind == "concat":
+        # a+b+c+... is a left-deep tree, so gather all of its parts
+        #   and build a single Concat out of them.
+        parts = []
+        while isinstance(node, ParseTree) and node.kind == "concat":
+            parts.append(node.children[1])
+            node = node.children[0]
+        parts.append(node)
+        return parts[::-1]
+    return node.children
+
+
+# Returns a NaturalVector for a literal whose elements are all natural tokens,
+#   or None if it has other elements (or naturals too big for the array).
+#
+def packLiteral(parts):
+    if not parts or not all(isinstance(p, Token) and p.cls == "natural" for p in parts):
+        return None
+    try:
+        return NaturalVector(array('Q', [p.val for p in parts]))
+    except OverflowError:
+        return None
+
+
+# Returns the naturals that make up a String or NaturalVector as an array, or
+#   None for any other queue, or for one that was named in the program, since
+#   a named queue can be read from elsewhere and has to stay lazy.
+#
+def _packed(part, queue):
+    if isinstance(part, Token) and part.cls == "name":
+        return None
+    if type(queue) is NaturalVector:
+        return queue.values[queue.index:]
+    if type(queue) is String:
+        return array('Q', map(ord, queue.value[queue.index:]))
+    return None
+
+
+# Builds the queue for a tree out of the queues for its operands.
+#
+def makeNode(node, parts, queues):
+    if node.kind == "literal":
+        return Literal(queues)
+    elif node.kind == "concat":
+        # Runs of naturals that are concatenated with a vector are packed
+        #   into one bigger vector.
+        if any(type(q) is NaturalVector for q in queues):
+            packed = [_packed(p, q) for p, q in zip(parts, queues)]
+            if None not in packed:
+                values = array('Q')
+                for run in packed:
+                    values += run
+                return NaturalVector(values)
+        return Concat(*queues)
+    elif node.kind == "factory":
+        return SafeFactory(queues[0])
+    elif node.kind == "zip":
+        # Each element of a zip is a pair of elements concatenated, so zipping
+        #   two runs of naturals adds them up pairwise.
+        if any(type(q) is NaturalVector for q in queues):
+            fst, snd = [_packed(p, q) for p, q in zip(parts, queues)]
+            if fst is not None and snd is not None:
+                try:
+                    return NaturalVector(array('Q', map(add, fst, snd)))
+                except OverflowError:
+                    pass
+        return Zip(queues[0], queues[1])
+    elif node.kind == "flatten":
+        return Flatten(queues[0])
+    elif node.kind == "take":
+        return Head(queues[0])
+    elif node.kind == "star":
+        fst, snd = queues
+        if isinstance(fst, String):
+            return StringRepeat(fst, snd)
+        return Repeat(fst, snd)
+    else:
+        raise NotImplementedError(str(node))
+
 
 def makeQueue(node):
-    if isinstance(node, Token):
-        if node.cls == "natural":
-            return Natural(node.val)
-        elif node.cls == "string":
-            return String(node.val)
-        elif node.cls == "name":
-            if node.val in GLOBALS:
-                return GLOBALS[node.val]
-            else:
-                return Nil
-        elif node.cls == "keyword":
-            if node.val == 'get':
-                return Natural(1)       # TODO
-            elif node.val == 'getNum':
-                return Natural(1)       # TODO
-            elif node.val == 'getStr':
-                return Natural(1)       # TODO
-            else:
-                return Nil
-        else:
+    # Trees can be nested far deeper than Python's stack allows (think
+    #   [[[[...]]]]), so rather than recursing, this keeps a stack of trees
+    #   that are waiting on their operands, and the queues built so far.
+    done = []
+    stack = [(node, None)]
+    while stack:
+        node, parts = stack.pop()
+        if isinstance(node, Token):
+            done.append(makeLeaf(node))
+        elif not isinstance(node, ParseTree):
             raise NotImplementedError(str(node))
-
-    elif isinstance(node, ParseTree):
-        if node.kind == "literal":
-            return Literal([makeQueue(elem) for elem in node.children])
-        elif node.kind == "concat":
-            fst = makeQueue(node.children[0])
-            snd = makeQueue(node.children[1])
-            return Concat(fst, snd)
-        elif node.kind == "factory":
-            queue = makeQueue(node.children[0])
-            return SafeFactory(queue)
-        elif node.kind == "zip":
-            fst = makeQueue(node.children[0])
-            snd = makeQueue(node.children[1])
-            return Zip(fst, snd)
-        elif node.kind == "flatten":
-            queue = makeQueue(node.children[0])
-            return Flatten(queue)
-        elif node.kind == "star":
-            # a*b is syntactic sugar for _(b~$a)
-            fst = makeQueue(node.children[0])
-            snd = makeQueue(node.children[1])
-            return Flatten(Zip(snd, SafeFactory(fst)))
+        elif parts is None:
+            # (A literal of naturals is packed straight from its tokens.)
+            packed = packLiteral(node.children) if node.kind == "literal" else None
+            if packed is not None:
+                done.append(packed)
+                continue
+            parts = operands(node)
+            stack.append((node, parts))
+            stack.extend((part, None) for part in reversed(parts))
         else:
-            raise NotImplementedError(str(node))
+            queues = done[len(done) - len(parts):]
+            del done[len(done) - len(parts):]
+            done.append(makeNode(node, parts, queues))
+    return done[0]
 
 
 ################################################################################
 
 
+# Iterates over the queue, taking its elements in batches when that can't
+#   change the result (see Queue.fresh). Every element counts as a step
+#   towards the active governor's limit.
+#
+def elements(queue):
+    limits = governor.active
+    # (Lists, as from listify, and other iterables are passed straight through.)
+    if not isinstance(queue, Queue) or not queue.fresh():
+        for elem in queue:
+            limits.left -= 1
+            if limits.left < 0:
+                limits.overrun()
+            yield elem
+        return
+    while True:
+        batch = queue.next_batch(BATCH)
+        limits.left -= len(batch)
+        if limits.left < 0:
+            limits.overrun()
+        yield from batch
+        if len(batch) < BATCH:
+            return
+
+
+# These two go down through the elements of the queue with a stack of their
+#   own instead of recursing, since queues can be nested far deeper than
+#   Python's stack allows.
+
 def listify(queue):
-    return [listify(elem) for elem in queue]
+    out = []
+    stack = [(elements(queue), out)]
+    while stack:
+        it, lst = stack[-1]
+        for elem in it:
+            lst.append([])
+            stack.append((elements(elem), lst[-1]))
+            break
+        else:
+            stack.pop()
+    return out
 
 
 def stirfry(queue):
-    pretty = ", ".join(stirfry(q) for q in queue)
-    return ("ε" if len(pretty) == 0 else "["+pretty+"]")
-
+    out = []
+    # The elements of each queue that's been opened but not finished, and
+    #   whether anything of the innermost one has been written yet.
+    stack = []
+    it, started = elements(queue), False
+    while True:
+        for elem in it:
+            out.append(", " if started else "[")
+            stack.append(it)
+            it, started = elements(elem), False
+            break
+        else:
+            out.append("]" if started else "ε")
+            if not stack:
+                return "".join(out)
+            it, started = stack.pop(), True
+
+
+# Collects what the printers write and hands it to the underlying stream in
+#   blocks of at least `size` characters, so that printing a long string costs
+#   one write per block instead of one per character. An interactive Writer
+#   also passes on every line as soon as it's finished. Each flush is a safe
+#   point for the active governor to stop the line (see governor.py).
+#
+class Writer:
+    def __init__(self, out, size = FLUSH_SIZE, interactive = False):
+        self.out = out
+        self.size = size
+        self.interactive = interactive
+        self.chunks = []
+        self.pending = 0
+        self.ended = True       # whether what was flushed ended a line
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.pending += len(text)
+        if self.pending >= self.size or (self.interactive and text.endswith("\n")):
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            text = "".join(self.chunks)
+            self.out.write(text)
+            self.ended = text.endswith("\n")
+            self.chunks = []
+            self.pending = 0
+        self.out.flush()
+        governor.active.check()
+
+    # Returns True if nothing's been written since the end of the last line.
+    def at_line_start(self):
+        for text in reversed(self.chunks):
+            if text:
+                return text.endswith("\n")
+        return self.ended
+
+
+# How printStr shows the code points below 128, with the first 28 spelled out
+#   (and dimmed) in caret notation, and the same thing as a table for
+#   str.translate.
+ZCHR = [(f"\x1B[2m^{chr(64+n)}\x1B[22m" if n < 28 else chr(n)) for n in range(128)]
+CARETS = {n: ZCHR[n] for n in range(28)}
 
 def zchr(n):
-    return (f"\x1B[2m^{chr(64+n)}\x1B[22m" if n < 28 else chr(n))
+    return ZCHR[n] if n < 128 else chr(n)
 
 
 def printNum(queue, out):
@@ -317,45 +1994,200 @@ def printNum(queue, out):
 
 
 def printStr(queue, out):
-    while True:
+    if type(queue) is String:
+        # The elements of a string are its characters.
+        out.write(queue.value[queue.index:].translate(CARETS))
+        queue._drain()
+    elif type(queue) is NaturalVector and max(queue.values[queue.index:], default=0) <= MAX_CHAR:
+        out.write("".join(map(chr, queue.values[queue.index:])).translate(CARETS))
+        queue._drain()
+    else:
+        chars = map(zchr, map(len, elements(queue)))
+        while block := "".join(islice(chars, BATCH)):
+            out.write(block)
+    out.write("\n")
+
+
+def printRepr(queue, out):
+    # Hollow elements (or a hollow queue's elements, which are empty) can be
+    #   written out from their sizes alone.
+    shape = queue.shape()
+    if shape.hollow:
+        render = lambda q: "ε"
+    elif shape.inner is not None and shape.inner.hollow:
+        render = lambda q: _stirfryShape(len(q))
+    else:
+        render = stirfry
+    sep = ""
+    for q in elements(queue):
+        out.write(sep)
+        out.write(render(q))
+        sep = ", "
+    out.write("\n" if sep else "ε\n")
+
+
+# Inspects one element of the queue being printed, pulling at most 128 of its
+#   elements and one element from each of those. Returns the number of
+#   (empty) elements it has if that's below 128, or else an iterable that
+#   replays what was pulled followed by the rest of the element.
+#
+def _classify(elem):
+    if elem.hollow():
+        pulled = elem.skip(128)
+        governor.active.spend(pulled)
+        return pulled if pulled < 128 else chain([()] * pulled, elements(elem))
+    pulled = 0
+    subs = elements(elem)
+    for sub in subs:
+        if pulled == 127:
+            return chain([()] * pulled, [sub], subs)
         try:
-            q = next(queue)
-            out.write(zchr(len(q)))
+            first = next(sub)
         except StopIteration:
-            out.write("\n")
-            break
+            pulled += 1
+            continue
+        return chain([()] * pulled, [chain([first], elements(sub))], subs)
+    return pulled
 
 
-def printRepr(queue, out):
-    out.write(", ".join(stirfry(q) for q in queue) or "ε")
-    out.write("\n")
+def _stirfryShape(shape):
+    if isinstance(shape, int):
+        return "[" + ", ".join(["ε"] * shape) + "]" if shape else "ε"
+    return stirfry(shape)
 
 
+# Prints numbers if every element is empty, strings if every element is a
+#   character (1 to 127 empty elements), and reprs otherwise. Unless the
+#   queue's Shape settles it up front, the elements are looked at one at a
+#   time, so only a count (or a byte per character) is held until the choice
+#   is made, and reprs are written as they come.
+#
 def smartPrint(queue, out):
-    lst = listify(queue)
-    if all(len(e) == 0 for e in lst):
-        out.write("%d\n" % len(lst))
-    elif all(len(s) > 0 and len(s) < 128 and all(len(e)==0 for e in s) for s in lst):
-        out.write("".join(zchr(len(s)) for s in lst))
-        out.write("\n")
+    if queue.hollow():
+        out.write("%d\n" % len(queue))
+        return
+    # An empty queue still prints as 0, so only a queue known to have
+    #   elements can go straight to printStr.
+    shape = queue.shape()
+    elems = shape.inner
+    if shape.lo > 0 and elems is not None and elems.hollow and 0 < elems.lo <= elems.hi < 128:
+        printStr(queue, out)
+        return
+    it = elements(queue)
+    empties, chars = 0, bytearray()
+    for elem in it:
+        shape = _classify(elem)
+        if shape == 0 and not chars:
+            empties += 1
+        elif shape != 0 and isinstance(shape, int) and not empties:
+            chars.append(shape)
+        else:
+            break
     else:
-        # since stirfry actually works on lists as well
-        out.write(", ".join(stirfry(e) for e in lst) or "ε")
-        out.write("\n")
+        if chars:
+            out.write(chars.decode('ascii').translate(CARETS))
+            out.write("\n")
+        else:
+            out.write("%d\n" % empties)
+        return
+    # since stirfry actually works on any iterable as well
+    for n in range(empties):
+        out.write("ε, ")
+    for n in chars:
+        out.write(_stirfryShape(n) + ", ")
+    out.write(_stirfryShape(shape))
+    for elem in it:
+        out.write(", ")
+        out.write(stirfry(elem))
+    out.write("\n")
 
 
 ################################################################################
 
 
+# Prints the queue with the given printer within the limits of the governor,
+#   or as much of it as fits, followed by a warning that says which limit it
+#   ran into.
+#
+def output(printer, queue, out, limits = None):
+    try:
+        with limits or GOVERNOR:
+            printer(queue, out)
+    except (Exhausted, MemoryError) as error:
+        limit = str(error) if isinstance(error, Exhausted) else "out of memory"
+        if not out.at_line_start():
+            out.write("\n")
+        out.flush()
+        print(f"\x1B[93mwarning\x1B[39m: output truncated after {limit}")
+
+
+# Runs one line of the program, once it's been parsed and optimized, recording
+#   how long it takes to build and print it on the trace, if one is given.
+#   Print commands run within the given limits, or GOVERNOR's by default.
+#
+def execute(tree, out, trace = UNTIMED, limits = None):
+    if isinstance(tree, ParseTree) and tree.kind == 'assignment':
+        name = tree.children[0].val
+        with trace.span('build'):
+            q = makeQueue(tree.children[1])
+        GLOBALS[name] = q
+
+    elif isinstance(tree, ParseTree) and tree.kind == 'output':
+        cmd = tree.children[0].val
+        with trace.span('build'):
+            q = makeQueue(tree.children[1])
+        if cmd == 'print':
+            printer = smartPrint
+        elif cmd == 'printNum':
+            printer = printNum
+        elif cmd == 'printStr':
+            printer = printStr
+        elif cmd == 'printRepr':
+            printer = printRepr
+        else:
+            raise Exception("this should never happen")
+        with trace.printing(cmd):
+            output(printer, q, out, limits)
+
+    else:
+        with trace.span('build'):
+            q = makeQueue(tree)
+        with trace.printing('smartPrint'):
+            output(smartPrint, q, out, PREVIEW)
+
+
 def repl():
 
     from sys import exit, stdout
 
+    # Output goes out a line at a time at a terminal, and otherwise in blocks,
+    #   but everything's flushed before the next prompt.
+    out = Writer(stdout, interactive=stdout.isatty())
+
+    # The Profile of the last line that was run with PROFILE on.
+    last = None
+
+    def command(words):
+        global PROFILE
+        if words == ['profile']:
+            if last is None:
+                print("\x1B[2mprofile: nothing to show (`:profile on` to start)\x1B[22m")
+            else:
+                last.report()
+        elif words in (['profile', 'on'], ['profile', 'off']):
+            PROFILE = words[1] == 'on'
+        else:
+            print(f"\x1B[91merror\x1B[39m: unknown command :{' '.join(words)}")
+
     def prompt():
+        out.flush()
         print("\x1B[2mdq>\x1B[22m ", end='')
         line = input()
         if line in ['exit', 'quit']:
             exit()
+        if line.startswith(":"):
+            command(line[1:].split())
+            return "\n"
         return line + "\n"
 
     stream = TokenStream("", prompt)
@@ -371,39 +2203,186 @@ def repl():
                 tree.display(stream.log)
                 continue
 
-            if isinstance(tree, ParseTree) and tree.kind == 'assignment':
-                name = tree.children[0].val
-                q = makeQueue(tree.children[1])
-                GLOBALS[name] = q
-
-            elif isinstance(tree, ParseTree) and tree.kind == 'output':
-                cmd = tree.children[0].val
-                q = makeQueue(tree.children[1])
-                if cmd == 'print':
-                    smartPrint(q, stdout)
-                elif cmd == 'printNum':
-                    printNum(q, stdout)
-                elif cmd == 'printStr':
-                    printStr(q, stdout)
-                elif cmd == 'printRepr':
-                    printRepr(q, stdout)
-                else:
-                    raise Exception("this should never happen")
+            tree, eliminated = optimizer.optimize(tree)
+            if optimizer.DEBUG:
+                print(f"\x1B[2moptimizer: eliminated {eliminated} nodes\x1B[22m")
 
+            if PROFILE:
+                import profiler
+                last = profiler.Profile()
+                with last:
+                    execute(tree, out, limits=PREVIEW)
             else:
-                q = makeQueue(tree)
-                fq = Take(q, 1024*1024)
-                smartPrint(fq, stdout)
-                if fq.halted:
-                    print("\x1B[93mwarning\x1B[39m: output truncated")
+                execute(tree, out, limits=PREVIEW)
 
     except KeyboardInterrupt:
+        out.flush()
         print("\b\b")
 
     except EOFError:
+        out.flush()
         print('exit')
 
 
+# How much of a script, or of the input, is read at a time.
+#
+CHUNK_SIZE = 1 << 16
+
+# Returns the number of the line a tree starts on, or None if it doesn't have
+#   any tokens (like `[]`).
+#
+def _line(tree):
+    while isinstance(tree, ParseTree) and tree.children:
+        tree = tree.children[0]
+    return tree.ln if isinstance(tree, Token) else None
+
+
+# Runs a whole program from the named file, or from stdin if the name is "-",
+#   without prompting for it a line at a time. Stops at the first line that
+#   doesn't parse, and shows why on stderr. Returns the exit status: 0 if
+#   every line ran, 1 after a parse error, and 2 if the file couldn't be read.
+#
+# Unless cached is False, the trees of a file that parsed all the way through
+#   are kept in the cache (see cache.py), and used instead of the file the next
+#   time it's run, if it hasn't changed.
+#
+# If trace names a file, a timeline of how long each line spent in each stage
+#   is saved there (see timeline.py).
+#
+def script(path, cached = True, trace = None):
+
+    from sys import stdin, stdout, stderr
+
+    try:
+        file = stdin if path == '-' else open(path, encoding='utf-8')
+    except OSError as error:
+        print(f"dq: can't open {path}: {error.strerror}", file=stderr)
+        return 2
+
+    out = Writer(stdout, interactive=stdout.isatty())
+    stream = TokenStream("", lambda: file.read(CHUNK_SIZE))
+    timeline = UNTIMED if trace is None else Timeline(path)
+    timeline.watch(out)
+
+    try:
+        key = None
+        if cached and file is not stdin:
+            import cache
+            key = cache.key(path)
+            with timeline.span('cache'):
+                program = cache.load(key)
+            if program is not None:
+                for tree in program:
+                    begun = timeline.now()
+                    timeline.line = _line(tree)
+                    execute(tree, out, timeline)
+                    timeline.add("line" if timeline.line is None else f"line {timeline.line}",
+                                 begun, timeline.now())
+                return 0
+
+        program = []
+        while not stream.finished():
+            begun = timeline.now()
+            try:
+                line = read_line(stream)
+            except LexError as error:
+                out.flush()
+                ParseError(str(error), error.token).display(stream.log, stderr)
+                return 1
+
+            if not line:
+                continue
+
+            timeline.line = line[0].ln
+            timeline.add('lex', begun, timeline.now())
+            with timeline.span('parse'):
+                tree = parse_tokens(line)
+
+            if isinstance(tree, ParseError):
+                out.flush()
+                tree.display(stream.log, stderr)
+                return 1
+
+            with timeline.span('optimize'):
+                tree, eliminated = optimizer.optimize(tree)
+            if key is not None:
+                program.append(tree)
+            execute(tree, out, timeline)
+            timeline.add(f"line {timeline.line}", begun, timeline.now())
+
+        timeline.line = None
+        if key is not None:
+            with timeline.span('cache'):
+                cache.store(key, program)
+
+    except KeyboardInterrupt:
+        return 130
+
+    finally:
+        timeline.line = None
+        out.flush()
+        if file is not stdin:
+            file.close()
+        if trace is not None:
+            error = timeline.save(trace)
+            if error is not None:
+                print(f"dq: {error}", file=stderr)
+
+    return 0
+
+
 if __name__ == '__main__':
-    repl()
 
+    from sys import argv, exit, modules, stderr
+
+    # profiler.py imports this module by name, and has to get this copy of it
+    #   rather than loading a second one.
+    modules['evaluator'] = modules[__name__]
+
+    USAGE = "usage: dq [--no-cache] [--trace out.json] [--max-steps N] [--max-seconds S]\n" \
+            "          [--max-memory MB] [--input file] [file.dq | -]"
+
+    # Each of these takes a number, where 0 means no limit, and sets it for
+    #   every line, whether printed by a command or not.
+    LIMITS = {'--max-steps':   ('steps',   1),
+              '--max-seconds': ('seconds', None),
+              '--max-memory':  ('memory',  1 << 20)}
+
+    args, cached, trace = argv[1:], True, None
+    while args and args[0].startswith('--'):
+        if args[0] == '--no-cache':
+            cached, args = False, args[1:]
+        elif args[0] == '--trace' and len(args) > 1:
+            trace, args = args[1], args[2:]
+        elif args[0] == '--input' and len(args) > 1:
+            # (get, getNum, and getStr read stdin by default, which is no
+            #   good if that's where the script is coming from.)
+            if args[1] != '-':
+                try:
+                    INPUT = Input(open(args[1], encoding='utf-8'))
+                except OSError as error:
+                    print(f"dq: can't open {args[1]}: {error.strerror}", file=stderr)
+                    exit(2)
+            args = args[2:]
+        elif args[0] in LIMITS and len(args) > 1:
+            name, unit = LIMITS[args[0]]
+            try:
+                value = float(args[1])
+            except ValueError:
+                exit(USAGE)
+            if value < 0:
+                exit(USAGE)
+            if unit is not None:
+                value = int(value * unit)
+            setattr(GOVERNOR, name, value or None)
+            setattr(PREVIEW, name, value or None)
+            args = args[2:]
+        else:
+            exit(USAGE)
+    if len(args) == 1:
+        exit(script(args[0], cached=cached, trace=trace))
+    elif args or not cached or trace is not None:
+        # (The REPL doesn't use the cache or keep a trace.)
+        exit(USAGE)
+    else:
+        repl()
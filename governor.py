@@ -0,0 +1,154 @@
+import os, threading
+from time import monotonic
+
+try:
+    import signal
+except ImportError:
+    signal = None
+
+# A Governor puts limits on what printing a line can cost, so that one line
+#   (like `printNum $x`, which never finishes) can't hold up everything after
+#   it. There are three limits, any of which can be None for no limit:
+#
+#   steps    how many elements the printers can take, at every level of
+#            nesting (a queue whose size is known is measured without taking
+#            any, so that costs nothing)
+#   seconds  how long the line can run for
+#   memory   how many bytes the process can grow by while it runs
+#
+# Once a limit trips, Exhausted is raised, saying which one.
+#
+#   with governor:
+#       printRepr(queue, out)
+#
+# Time and memory are measured every TICK seconds by a timer. The timer can
+#   go off in the middle of anything, like a queue that's halfway through
+#   taking an element (and that a name may still hold), so it only notes
+#   which limit tripped. Exhausted is raised at the next safe point: when
+#   the steps are settled (at least every POLL steps), or when the output is
+#   flushed. A line that's stuck inside a single call to next() (like
+#   `_$""`, which looks for a nonempty element forever) never gets to one,
+#   and can only be interrupted. The timer needs SIGALRM and the main thread;
+#   without them, time and memory are measured at the safe points instead.
+#
+# The printers count steps by taking them off self.left, and only call
+#   overrun() once it drops below 0, so that counting costs next to nothing.
+
+TICK = 0.05
+POLL = 1 << 16
+
+
+class Exhausted(Exception):
+    pass
+
+
+# Returns how many bytes of memory the process is using, or None if there's
+#   no way to tell.
+#
+def resident():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # (The most that's ever been in use, which is the best there is. It's in
+    #   kilobytes, except on macOS.)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class Governor:
+    def __init__(self, steps = None, seconds = None, memory = None):
+        self.steps   = steps
+        self.seconds = seconds
+        self.memory  = memory
+        self.left    = float('inf')     # steps left until overrun() is due
+        self.stretch = float('inf')     # what self.left was counting down from
+        self.budget  = float('inf')     # steps left before that
+        self.deadline = None
+        self.base    = None             # how much memory was in use at first
+        self.timer   = False
+        self.tripped = None             # what the timer found, if anything
+        self.outer   = None
+
+    def __repr__(self):
+        return f"Governor(steps={self.steps}, seconds={self.seconds}, memory={self.memory})"
+
+    def __enter__(self):
+        global active
+        self.outer, active = active, self
+        self.budget = float('inf') if self.steps is None else self.steps
+        self.stretch = self.left = 0
+        self.deadline = None if self.seconds is None else monotonic() + self.seconds
+        self.base = resident() if self.memory is not None else None
+        self.tripped = None
+        self.timer = (self.deadline is not None or self.base is not None) \
+                     and signal is not None and hasattr(signal, 'setitimer') \
+                     and threading.current_thread() is threading.main_thread()
+        if self.timer:
+            self.handler = signal.signal(signal.SIGALRM, lambda signum, frame: self.watch())
+            signal.setitimer(signal.ITIMER_REAL, TICK, TICK)
+        self.overrun()
+        return self
+
+    def __exit__(self, *exc):
+        global active
+        if self.timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.handler)
+            self.timer = False
+        active, self.outer = self.outer, None
+        return False
+
+    # Counts n more elements taken.
+    def spend(self, n):
+        self.left -= n
+        if self.left < 0:
+            self.overrun()
+
+    # Called once self.left drops below 0, to settle up the steps that have
+    #   been taken since the last time, check the other limits, and start
+    #   counting down the next stretch.
+    def overrun(self):
+        self.budget -= self.stretch - self.left
+        if self.budget < 0:
+            raise Exhausted(f"more than {self.steps} steps")
+        limited = self.deadline is not None or self.base is not None
+        if limited:
+            self.check()
+        self.stretch = self.left = min(self.budget, POLL) if limited else self.budget
+
+    # Raises Exhausted if the line has run out of time or memory. Only called
+    #   at safe points (see above).
+    def check(self):
+        tripped = self.tripped if self.timer else self.exceeded()
+        if tripped is not None:
+            raise Exhausted(tripped)
+
+    # Called by the timer, to note the first limit that trips.
+    def watch(self):
+        if self.tripped is None:
+            self.tripped = self.exceeded()
+
+    # Returns which limit on time or memory the line has run past, or None.
+    def exceeded(self):
+        if self.deadline is not None and monotonic() > self.deadline:
+            return f"more than {self.seconds:g} seconds"
+        if self.base is not None:
+            used = resident()
+            if used is not None and used - self.base > self.memory:
+                return f"more than {self.memory / (1 << 20):g} MB of memory"
+        return None
+
+
+# A governor without limits, for when nothing's being printed.
+#
+UNGOVERNED = Governor()
+
+# The governor whose limits apply right now.
+#
+active = UNGOVERNED
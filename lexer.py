@@ -66,15 +66,43 @@ NON_WORD = ( (DELIMITER | SPECIAL | SEPARATOR | OPERATOR_START
 
 SORTED_OPERATOR = list(reversed(sorted(OPERATOR, key = len)))
 
+# Everything that a longer operator starts with, and the length of the longest.
+#
+OPERATOR_PREFIX  = set(opr[:n] for opr in OPERATOR for n in range(1, len(opr)))
+LONGEST_OPERATOR = max(map(len, OPERATOR))
+
 import re
-ws_regex  = re.compile(r"\s+")
-num_regex = re.compile(r"\d+")
+
+def char_class(chars, negate = False):
+    if len(chars) == 0:
+        return ("." if negate else "(?!)")
+    return "[" + ("^" if negate else "") + "".join(map(re.escape, sorted(chars))) + "]"
+
+# A single regex that recognizes the start of every kind of token, so that the
+#   lexer only ever looks at the text under its cursor. The alternatives are in
+#   the order the lexer tries them in, and the operators are sorted longest
+#   first so that the longest one wins.
+#
+token_regex = re.compile("|".join([
+    r"(?P<whitespace>\s+)",
+    r"(?P<comment>" + re.escape(COMMENT) + ")",
+    r"(?P<natural>\d+)",
+    r"(?P<string>" + re.escape(STRING_LEFT) + ")",
+    r"(?P<delimiter>" + char_class(DELIMITER) + ")",
+    r"(?P<special>" + char_class(SPECIAL) + ")",
+    r"(?P<separator>" + char_class(SEPARATOR) + ")",
+    r"(?P<operator>" + "|".join(map(re.escape, SORTED_OPERATOR))
+                     + "|" + char_class(OPERATOR_START) + ")",
+    r"(?P<word>" + char_class(NON_WORD, negate = True) + "+)",
+]))
 
 
 ################################################################################
 
 
 class Token:
+    __slots__ = ('txt', 'ln', 'col', 'val', 'cls')
+
     def __init__(self, text, line, column, token_value, token_class):
         self.txt = text
         self.ln  = line
@@ -107,61 +135,148 @@ class Token:
         return f"⟨{tk} {value} : {self.cls} @ {self.ln},{self.col}⟩"
 
 
+# Raised by a TokenStream for text that can't be split into tokens. The token
+#   is where the trouble starts (like the opening quote of a string that's
+#   never closed), for showing the error the same way as a ParseError.
+#
+class LexError(Exception):
+    def __init__(self, message, token):
+        super().__init__(message)
+        self.token = token
+
+
+# How many of the most recent lines a TokenStream keeps in its log.
+#
+LOG_LINES = 1000
+
+
+class Log:
+    # The last few lines of the text that went through a TokenStream, so that
+    #   an error can show the line it's on. Line n is kept in ring[(n-1) % size]
+    #   until it's overwritten by line n+size, and the line that's still being
+    #   read is kept on its own.
+    def __init__(self, size):
+        self.ring    = [None] * size
+        self.count   = 0        # how many lines have been completed
+        self.partial = ""
+
+    def append(self, text):
+        lines = text.split("\n")
+        if len(lines) == 1:
+            self.partial += text
+            return
+        lines[0] = self.partial + lines[0]
+        self.partial = lines.pop()
+        # (Only the last few lines of a long text make it into the ring.)
+        size = len(self.ring)
+        start = max(len(lines) - size, 0)
+        self.count += start
+        for line in lines[start:]:
+            self.ring[self.count % size] = line
+            self.count += 1
+
+    # Returns line n (counting from 1, like Token.ln), or None if it's no
+    #   longer kept.
+    def line(self, n):
+        if n == self.count + 1:
+            return self.partial
+        if self.count - len(self.ring) < n <= self.count and n > 0:
+            return self.ring[(n - 1) % len(self.ring)]
+        return None
+
+
 class TokenStream:
     # text  :=  text to be tokenized
     # more  :=  nullary function that will be called to get more text
     def __init__(self, text, more = None):
         self.text   = text
+        self.pos    = 0         # everything before this has been tokenized
         self.more   = more
         self.line   = 1
         self.column = 1
         self.last_emitted_newline = False
 
-        self.log = text
+        self.log = Log(LOG_LINES)
+        self.log.append(text)
 
-    def _advance(self, string):
-        newlines = string.count("\n")
+    def _advance(self, end):
+        newlines = self.text.count("\n", self.pos, end)
         if newlines == 0:
-            self.column = self.column + len(string)
+            self.column = self.column + (end - self.pos)
         else:
             self.line = self.line + newlines
-            self.column = len(string) - string.rindex("\n")
+            self.column = end - self.text.rindex("\n", self.pos, end)
+        self.pos = end
+
+    # Appends more text to the buffer, dropping whatever has already been
+    #   tokenized. Offsets relative to self.pos are unaffected. Returns False
+    #   if there's no more text to be had, which self.more signals by
+    #   returning an empty string (like reading from a file at its end).
+    def _extend(self):
+        if self.more is None:
+            return False
+        continuation = self.more()
+        if not continuation:
+            self.more = None
+            return False
+        self.text = self.text[self.pos:] + continuation
+        self.pos  = 0
+        self.log.append(continuation)
+        return True
+
+    # Returns True once all of the text has been tokenized and there's no
+    #   more to be had.
+    def finished(self):
+        return self.more is None and self.pos == len(self.text)
 
     def __next__(self): ########################################################
         while True:
+            # Is the text empty? ###########################################
+            if self.pos == len(self.text):
+                if not self._extend():
+                    return None
+                continue
+
+            match = token_regex.match(self.text, self.pos)
+            if match is None:
+                raise Exception("this should never happen")
+            kind = match.lastgroup
+
+            # A number or word that runs up to the end of the text, or an
+            #   operator that could be the start of a longer one, might carry
+            #   on in the text that comes next (when a file is read in chunks,
+            #   say), so get that first.
+            if kind in ('natural', 'word'):
+                cut = match.end() == len(self.text)
+            elif kind == 'operator':
+                cut = len(self.text) - self.pos < LONGEST_OPERATOR and \
+                      self.text[self.pos:] in OPERATOR_PREFIX
+            else:
+                cut = False
+            if cut and self._extend():
+                continue
+
             # Strip leading whitespace or return a newline #################
-            match = ws_regex.match(self.text)
-            if match is not None:
-                whitespace, self.text = match.group(), self.text[match.end():]
+            if kind == 'whitespace':
+                whitespace = match.group()
                 tok_line, tok_column = self.line, self.column
-                self._advance(whitespace)
+                self._advance(match.end())
                 if ("\n" in whitespace) and not self.last_emitted_newline:
                     self.last_emitted_newline = True
                     return Token(whitespace, tok_line, tok_column, None, 'newline')
-
-            # Is the text empty? ###########################################
-            if self.text == "":
-                if self.more is None:
-                    return None
-                continuation = self.more()
-                self.text += continuation
-                self.log  += continuation
                 continue
 
             # Is this a comment? ###########################################
-            if self.text.startswith(COMMENT):
+            # (Comments are skipped without moving the line and column.)
+            if kind == 'comment':
                 while True:
-                    try:
-                        end_of_comment = self.text.index("\n")
-                        self.text = self.text[end_of_comment:]
+                    end_of_comment = self.text.find("\n", self.pos)
+                    if end_of_comment >= 0:
+                        self.pos = end_of_comment
                         break
-                    except Exception:
-                        self.text = ""
-                        if self.more is None:
-                            return None
-                        continuation = self.more()
-                        self.text += continuation
-                        self.log  += continuation
+                    self.pos = len(self.text)
+                    if not self._extend():
+                        return None
                 continue
 
             ################################################################
@@ -173,37 +288,32 @@ class TokenStream:
 
             # Is the next token a natural number? #########################
             # TODO support 0x, 0o, and 0b notation
-            match = num_regex.match(self.text)
-            if match is not None:
+            if kind == 'natural':
                 numstr = match.group()
-                num = int(numstr)
-                self._advance(numstr)
-                self.text = self.text[match.end():]
-                return Token(numstr, tok_line, tok_column, num, 'natural')
+                self._advance(match.end())
+                return Token(numstr, tok_line, tok_column, int(numstr), 'natural')
 
             # Is the next token a string? ##################################
-            if self.text.startswith(STRING_LEFT):
-                self._advance(STRING_LEFT)
-                self.text = self.text[len(STRING_LEFT):]
+            if kind == 'string':
+                self._advance(match.end())
 
+                # idx is relative to self.pos, which _extend preserves.
                 idx = 0
                 while True:
-                    try:
-                        jdx = self.text.index(STRING_RIGHT, idx)
-                        if jdx > 0 and self.text[jdx-1] == ESCAPE_CHARACTER:
-                            idx = jdx + 1
-                        else:
-                            idx = jdx
-                            break
-                    except Exception:
-                        if self.more is None:
-                            raise Exception("unterminated string")
-                        continuation = self.more()
-                        self.text += continuation
-                        self.log  += continuation
-                string = self.text[:idx]
-                self._advance(string+STRING_RIGHT)
-                self.text = self.text[idx+len(STRING_RIGHT):]
+                    jdx = self.text.find(STRING_RIGHT, self.pos + idx)
+                    if jdx < 0:
+                        if not self._extend():
+                            raise LexError("unterminated string",
+                                           Token(STRING_LEFT, tok_line, tok_column, None, 'string'))
+                        continue
+                    jdx -= self.pos
+                    if jdx > 0 and self.text[self.pos + jdx - 1] == ESCAPE_CHARACTER:
+                        idx = jdx + 1
+                    else:
+                        idx = jdx
+                        break
+                string = self.text[self.pos:self.pos + idx]
+                self._advance(self.pos + idx + len(STRING_RIGHT))
 
                 literal = STRING_LEFT + string + STRING_RIGHT
                 string = string.replace('\\"', '"')
@@ -214,40 +324,19 @@ class TokenStream:
                 return Token(literal, tok_line, tok_column, string, 'string')
 
             # Is the next token a delimr, special char, sepr, or opr? ######
-            value = self.text[0]
-            if value in (DELIMITER | SPECIAL | SEPARATOR | OPERATOR_START):
-                if value in DELIMITER:
-                    tok_class = 'delimiter'
-                elif value in SPECIAL:
-                    tok_class = 'special'
-                elif value in SEPARATOR:
-                    tok_class = 'separator'
-                else:
-                    tok_class = 'operator'
-                    for opr in SORTED_OPERATOR:
-                        if self.text.startswith(opr):
-                            value = opr
-                            break
-                self._advance(value)
-                self.text = self.text[len(value):]
-                return Token(value, tok_line, tok_column, value, tok_class)
+            if kind != 'word':
+                value = match.group()
+                self._advance(match.end())
+                return Token(value, tok_line, tok_column, value, kind)
 
             # The next token must be a name or keyword #####################
-            idx = 0
-            while not (idx == len(self.text) or (self.text[idx] in NON_WORD)):
-                idx += 1
-            idx -= 1
-            while self.text[idx] in MID_WORD_SYMBOL:
-                idx -=1
-            idx += 1
-            if idx < len(self.text) and self.text[idx] in END_WORD_SYMBOL:
-                word = self.text[:idx+1]
-                self._advance(word)
-                self.text = self.text[idx+1:]
-            else:
-                word = self.text[:idx]
-                self._advance(word)
-                self.text = self.text[idx:]
+            end = match.end()
+            while end > self.pos and self.text[end-1] in MID_WORD_SYMBOL:
+                end -= 1
+            if end < len(self.text) and self.text[end] in END_WORD_SYMBOL:
+                end += 1
+            word = self.text[self.pos:end]
+            self._advance(end)
             tok_class = ('keyword' if word in KEYWORD else 'name')
             return Token(word, tok_line, tok_column, word, tok_class)
 
@@ -0,0 +1,133 @@
+from lexer  import Token, STRING_LEFT, STRING_RIGHT
+from parser import ParseTree
+
+# Set DEBUG = True to have the REPL report how many nodes each line lost.
+#
+DEBUG = False
+
+# Folding a string can make it much longer than the source that produced it
+#   (think "abc"*1000000000), and the unfolded queue is lazy, so only fold
+#   strings up to this many characters.
+#
+FOLD_LIMIT = 1 << 16
+
+# The largest code point a string can hold.
+#
+MAX_CHAR = 0x10FFFF
+
+
+def natural(val, where):
+    return Token(str(val), where.ln, where.col, val, 'natural')
+
+
+def string(val, where):
+    literal = STRING_LEFT + val + STRING_RIGHT
+    return Token(literal, where.ln, where.col, val, 'string')
+
+
+# Every rule below follows from what the evaluator does with the unfolded
+#   tree; e.g. a*b is _(b~$a), so 2*"Hello" is five naturals each followed by
+#   two empty queues, flattened into 72+101+108+108+111 + 5*2 = 510.
+#
+# That's only true of a fresh queue, though. The queue of a star or flatten
+#   starts over at its next element when it's copied (and a take is empty
+#   once its element has been started on), while a natural or a string
+#   copies whatever is left of it. So where the queue can be copied after
+#   some of it has been taken (copied is True, as for anything bound to a
+#   name), those three aren't folded; e.g. after `x := 3*2` and
+#   `printNum 1 ~ x`, $x is 3 long and not 5.
+#
+# Returns a token equivalent to the tree, or None if it can't be folded.
+#
+def fold(kind, args, copied = False):
+    if len(args) == 0 or not all(isinstance(arg, Token) for arg in args):
+        return None
+    where   = args[0]
+    classes = tuple(arg.cls for arg in args)
+    values  = tuple(arg.val for arg in args)
+
+    if kind == 'concat':
+        if classes == ('natural', 'natural'):
+            return natural(values[0] + values[1], where)
+        if classes == ('string', 'string'):
+            if len(values[0]) + len(values[1]) <= FOLD_LIMIT:
+                return string(values[0] + values[1], where)
+
+    elif kind == 'star' and not copied:
+        if classes == ('natural', 'natural'):
+            return natural(values[0] * values[1], where)
+        if classes == ('string', 'natural'):
+            if len(values[0]) * values[1] <= FOLD_LIMIT:
+                return string(values[0] * values[1], where)
+        if classes == ('natural', 'string'):
+            total = sum(map(ord, values[1])) + values[0] * len(values[1])
+            return natural(total, where)
+
+    elif kind == 'zip':
+        # Each element is the concatenation of a pair of elements, and the
+        #   elements of naturals are empty.
+        if classes == ('natural', 'natural'):
+            return natural(min(values), where)
+        if classes == ('string', 'natural'):
+            return string(values[0][:values[1]], where)
+        if classes == ('natural', 'string'):
+            return string(values[1][:values[0]], where)
+        if classes == ('string', 'string'):
+            chars = [ord(a) + ord(b) for a, b in zip(*values)]
+            if all(c <= MAX_CHAR for c in chars):
+                return string("".join(map(chr, chars)), where)
+
+    elif kind == 'take' and not copied:
+        # ^x is _(1~x), so it's as long as the first element of x.
+        if classes == ('natural',):
+            return natural(0, where)
+        if classes == ('string',):
+            return natural(ord(values[0][0]) if values[0] else 0, where)
+
+    elif kind == 'flatten' and not copied:
+        if classes == ('natural',):
+            return natural(0, where)
+        if classes == ('string',):
+            return natural(sum(map(ord, values[0])), where)
+
+    return None
+
+
+# Returns the simplified tree and the number of nodes that were eliminated.
+#
+def optimize(node):
+    # Trees can be nested far deeper than Python's stack allows, so this
+    #   walks them with a stack of its own: each node is visited once on the
+    #   way down, and then again once all of its children have been folded.
+    # Whatever's bound to a name can be copied (see fold), and so can every
+    #   part of it, except the elements of a list and the template of a
+    #   factory, which are only ever copied whole before they're taken.
+    done = []
+    eliminated = 0
+    stack = [(node, False, False)]
+    while stack:
+        node, ready, copied = stack.pop()
+        if not isinstance(node, ParseTree):
+            done.append(node)
+            continue
+        if not ready:
+            stack.append((node, True, copied))
+            if node.kind == 'assignment':
+                copied = True
+            elif node.kind in ('literal', 'factory'):
+                copied = False
+            stack.extend((child, False, copied) for child in reversed(node.children))
+            continue
+
+        children = done[len(done) - len(node.children):]
+        del done[len(done) - len(node.children):]
+
+        folded = fold(node.kind, children, copied)
+        if folded is not None:
+            # The tree and its arguments were replaced by a single token.
+            done.append(folded)
+            eliminated += len(children)
+        else:
+            done.append(ParseTree(node.kind, children))
+
+    return done[0], eliminated
@@ -9,12 +9,20 @@ from lexer import Token, TokenStream
 #
 DEBUG = False
 
+# Set LEGACY = True to parse with the original parser, which splices the line
+#   back together once for every parenthesis, bracket, and operator. (The debug
+#   output above comes from that parser, so DEBUG implies LEGACY.)
+#
+LEGACY = False
+
 
 # The token classes are  newline   ,  natural ,  string    ,
 #                        delimiter ,  special ,  separator ,  operator
 #                        keyword   ,  name
 
 class ParseTree:
+    __slots__ = ('kind', 'children')
+
     def __init__(self, kind, children):
         self.kind = kind            # instance of str
         self.children = children    # list of ParseTrees or Tokens
@@ -25,16 +33,18 @@ class ParseTree:
 
 
 def extract_tokens(obj):
-    if isinstance(obj, Token):
-        return [obj]
-    if isinstance(obj, ParseTree):
-        obj = obj.children
-    if isinstance(obj, list):
-        out = []
-        for x in obj:
-            out += extract_tokens(x)
-        return out
-    return []
+    # (With a stack rather than recursion, since trees can be very deep.)
+    out, stack = [], [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, Token):
+            out.append(obj)
+            continue
+        if isinstance(obj, ParseTree):
+            obj = obj.children
+        if isinstance(obj, list):
+            stack.extend(reversed(obj))
+    return out
 
 
 class ParseError:
@@ -47,29 +57,32 @@ class ParseError:
     def __repr__(self):
         return "\x1B[91merror\x1B[39m: " + self.message
 
-    def display(self, log):
+    # Shows the error and the line it's on, on stdout unless file says otherwise.
+    def display(self, log, file = None):
         tokens = extract_tokens(self.highlight)
         if len(tokens) < 1:
-            print("\x1B[91merror\x1B[39m: " + self.message)
+            print("\x1B[91merror\x1B[39m: " + self.message, file=file)
             return
         top = tokens[0].ln - 1
         bot = tokens[-1].ln - 1
         if bot-top > 1:
             return  # not sure how to display multi-line errors
                     #   (but fortunately, there aren't any yet)
-        print(f"\x1B[91merror\x1B[39m: line {tokens[0].ln}: " + self.message)
-        line = (log.split("\n"))[top]
+        print(f"\x1B[91merror\x1B[39m: line {tokens[0].ln}: " + self.message, file=file)
+        line = log.line(top + 1)
+        if line is None:
+            return  # too long ago to still be in the log
         margin = "\x1B[2m\u2502\x1B[22m "
-        print(margin)
-        print(margin + line)
+        print(margin, file=file)
+        print(margin + line, file=file)
         if not self.redux:
             left = tokens[0].col - 1                         # inclusive
             right = tokens[-1].col - 1 + len(tokens[-1].txt) # exclusive
-            print(margin + " "*left + "\x1B[91m^", end='')
-            print("~"*(right-left-1), end='')
-            print("\x1B[39m")
+            print(margin + " "*left + "\x1B[91m^", end='', file=file)
+            print("~"*(right-left-1), end='', file=file)
+            print("\x1B[39m", file=file)
         else:
-            print(margin, end='')
+            print(margin, end='', file=file)
             colors = ["\x1B[94m", "\x1B[93m", "\x1B[96m", "\x1B[95m"]
             color_idx = 0
             position = 0
@@ -78,13 +91,13 @@ class ParseError:
                 if len(tokens) > 0:
                     left = tokens[0].col - 1
                     right = tokens[-1].col - 1 + len(tokens[-1].txt)
-                    print(" " * (left-position), end='')
-                    print(colors[color_idx]+"^", end='')
-                    print("~"*(right-left-1), end='')
-                    print("\x1B[39m", end='')
+                    print(" " * (left-position), end='', file=file)
+                    print(colors[color_idx]+"^", end='', file=file)
+                    print("~"*(right-left-1), end='', file=file)
+                    print("\x1B[39m", end='', file=file)
                     color_idx = (color_idx + 1) % len(colors)
                     position += right-position
-            print()
+            print(file=file)
 
 
 ################################################################################
@@ -146,6 +159,7 @@ AcceptableTokens = {'natural', 'string', 'name', 'keyword'}
 #                       and [op, 'prefix'|'postfix', kind] for unary ops
 #
 Operators = [['$', 'prefix', 'factory'],
+             ['^', 'prefix', 'take'   ],
              ['_', 'prefix', 'flatten'],
              ['~', 'left',   'zip'    ],
              ['*', 'left',   'star'   ],
@@ -156,7 +170,7 @@ Output = {'print', 'printNum', 'printStr', 'printRepr'}
 
 # Returns None, an instance of ParseTree, or an instance of ParseError.
 #
-def _parse(line, statement=False):
+def _parse_legacy(line, statement=False):
 
     if len(line) == 0:
         return None
@@ -177,7 +191,7 @@ def _parse(line, statement=False):
             if height == 0: break
             rp += 1
 
-        interior = _parse(line[lp+1:rp])
+        interior = _parse_legacy(line[lp+1:rp])
         if interior is None:
             return ParseError("nothing to parse inside parentheses", line[lp:rp+1])
         if isinstance(interior, ParseError):
@@ -233,7 +247,7 @@ def _parse(line, statement=False):
                     print("\x1B[" + str(elem[0].col+3) + "C^", end="\x1B[G")
             print()
         for elem in elems:
-            parsed_elem = _parse(elem)
+            parsed_elem = _parse_legacy(elem)
             if isinstance(parsed_elem, ParseError):
                 return parsed_elem
             interior.append(parsed_elem)
@@ -316,7 +330,13 @@ def _parse(line, statement=False):
     if len(line) < 1:
         raise Exception("this should never happen")
 
-    # ...unless this is a statement.
+    return _reduce(line, statement)
+
+
+# Takes what's left of a line once every operator has been applied.
+#
+def _reduce(line, statement):
+    # This is a statement.
     if statement:
         # Statments look like one of
         #   <name> := <tree|token>      # assignment
@@ -348,7 +368,173 @@ def _parse(line, statement=False):
         return line[0]
 
 
-def parse_line(stream):
+################################################################################
+
+
+# The parser below makes a single pass over the line, climbing the precedence
+#   levels in Operators (the level of an operator is its index, and a lower
+#   level binds tighter). It only knows how to parse lines that _parse_legacy
+#   would accept, and gives up on anything else by raising Unparsable, at which
+#   point _parse_legacy takes over. That way, the error messages and highlights
+#   are exactly the same, and the cost of producing them is only paid when
+#   there's an error to report.
+
+Levels = {op: (level, assoc, kind) for level, (op, assoc, kind) in enumerate(Operators)}
+Loosest = len(Operators) - 1
+
+
+class Unparsable(Exception):
+    pass
+
+
+def is_token(obj, val, cls):
+    return isinstance(obj, Token) and obj.cls == cls and obj.val == val
+
+
+class Climber:
+    def __init__(self, line):
+        self.line = line
+        self.pos  = 0
+
+    def peek(self):
+        if self.pos < len(self.line):
+            return self.line[self.pos]
+        return None
+
+    def expect(self, val, cls):
+        if not is_token(self.peek(), val, cls):
+            raise Unparsable
+        self.pos += 1
+
+    def operator(self, obj):
+        if isinstance(obj, Token) and obj.cls == 'operator':
+            return Levels.get(obj.val)
+        return None
+
+    # Parses an expression whose operators are all at the given level or
+    #   tighter, and stops at the first thing that can't continue it.
+    #
+    # Lines can be nested far deeper than Python's stack allows (think
+    #   [[[[...]]]]), so instead of calling itself for every operand,
+    #   parenthesis and bracket, this keeps the work that's waiting on the
+    #   current operand on a stack of its own. Each entry is one of
+    #
+    #     ('prefix', kind, limit)       apply a prefix operator to it
+    #     ('binary', kind, lhs, limit)  make it the right argument of lhs
+    #     ('paren', limit)              expect a right parenthesis after it
+    #     ('list', items, limit)        add it to a list literal
+    #
+    #   where limit is the level of the expression that continues afterwards.
+    def expression(self, limit):
+        waiting = []
+        while True:
+            # Start an operand: any prefix operators, and then an atom.
+            op = self.operator(self.peek())
+            if op is not None:
+                level, assoc, kind = op
+                if assoc != 'prefix' or level > limit:
+                    raise Unparsable
+                self.pos += 1
+                waiting.append(('prefix', kind, limit))
+                limit = level
+                continue
+
+            obj = self.peek()
+            if is_token(obj, '(', 'delimiter'):
+                self.pos += 1
+                waiting.append(('paren', limit))
+                limit = Loosest
+                continue
+            if is_token(obj, '[', 'delimiter'):
+                self.pos += 1
+                if not is_token(self.peek(), ']', 'delimiter'):
+                    waiting.append(('list', [], limit))
+                    limit = Loosest
+                    continue
+                self.pos += 1
+                lhs = ParseTree('literal', [])
+            elif isinstance(obj, Token) and obj.cls in AcceptableTokens:
+                self.pos += 1
+                lhs = obj
+            else:
+                raise Unparsable
+
+            # Continue the operand with binary and postfix operators, and once
+            #   it's finished, hand it to whatever's waiting on it.
+            while True:
+                op = self.operator(self.peek())
+                if op is not None:
+                    level, assoc, kind = op
+                    # A prefix operator here starts the next part of the line.
+                    if level <= limit and assoc != 'prefix':
+                        self.pos += 1
+                        if assoc == 'postfix':
+                            lhs = ParseTree(kind, [lhs])
+                            continue
+                        waiting.append(('binary', kind, lhs, limit))
+                        limit = level - 1 if assoc == 'left' else level
+                        break
+
+                if not waiting:
+                    return lhs
+                entry = waiting.pop()
+                if entry[0] == 'prefix':
+                    _, kind, limit = entry
+                    lhs = ParseTree(kind, [lhs])
+                elif entry[0] == 'binary':
+                    _, kind, arg, limit = entry
+                    lhs = ParseTree(kind, [arg, lhs])
+                elif entry[0] == 'paren':
+                    _, limit = entry
+                    self.expect(')', 'delimiter')
+                else:
+                    _, items, limit = entry
+                    items.append(lhs)
+                    if is_token(self.peek(), ',', 'separator'):
+                        self.pos += 1
+                        waiting.append(entry)
+                        limit = Loosest
+                        break
+                    self.expect(']', 'delimiter')
+                    lhs = ParseTree('literal', items)
+
+    def parse(self, statement):
+        items = []
+        while self.peek() is not None:
+            if statement and is_token(self.peek(), ':=', 'operator'):
+                items.append(self.peek())
+                self.pos += 1
+            else:
+                items.append(self.expression(Loosest))
+        if not statement and len(items) > 1:
+            raise Unparsable
+        return _reduce(items, statement)
+
+
+# Returns None, an instance of ParseTree, or an instance of ParseError.
+#
+def _parse(line, statement=False):
+    if LEGACY or DEBUG:
+        return _parse_legacy(line, statement)
+
+    if len(line) == 0:
+        return None
+
+    try:
+        return Climber(line).parse(statement)
+    except Unparsable:
+        pass
+    try:
+        return _parse_legacy(line, statement)
+    except RecursionError:
+        # The legacy parser recurses once for every level of nesting, so
+        #   it can't point out mistakes in lines nested deeper than that.
+        return ParseError("too deeply nested to report the error", line)
+
+
+# Returns the tokens of the next line, without the newline at its end.
+#
+def read_line(stream):
     # read until we encounter a newline
     line = []
     while True:
@@ -356,11 +542,18 @@ def parse_line(stream):
         if (tok is None) or (tok.cls == 'newline'):
             break
         line.append(tok)
+    return line
+
 
+# Returns None (for an empty line), an instance of ParseTree, or an instance of
+#   ParseError.
+#
+def parse_tokens(line):
     return _parse(line, True)
 
 
-################################################################################
+def parse_line(stream):
+    return parse_tokens(read_line(stream))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+from lexer  import Token
+from parser import ParseTree
+import evaluator
+from evaluator import Queue
+
+# Counts what the queues of a line do while it runs: how many times each queue
+#   is asked for an element, copied, and runs out (raises StopIteration), and
+#   how many queues are allocated. The counts are kept for each class of queue,
+#   and for each node of the tree that the queues came from. Queues built by
+#   makeQueue come from the node they were built for, and queues allocated
+#   while a queue is being asked for an element, copied, and so on come from
+#   that queue's node; e.g. the Naturals taken from "abc" come from "abc".
+#
+# While a Profile is active, the methods of every queue class are replaced with
+#   ones that count, and they're put back when it's done, so profiling costs
+#   nothing at all the rest of the time.
+#
+#   profile = Profile()
+#   with profile:
+#       evaluator.execute(tree, out)
+#   profile.report()
+#
+# Elements taken in batches (see Queue.next_batch and Queue.skip) are counted
+#   as if they'd been asked for one at a time, so a batch that comes up short
+#   counts as a stop too.
+
+COUNTS = ('next', 'copy', 'stop', 'alloc')
+
+# The methods that a queue might allocate other queues in, while whichever
+#   node it came from is charged for them.
+METHODS = ('__next__', 'copy', 'freeze', 'next_batch', 'skip', '_drop', '_drain',
+           '_head', '__len__')
+
+# Where a queue came from if it was built before the profile started (like the
+#   queue bound to a name on an earlier line), or where a queue that's
+#   allocated outside of any queue's methods came from.
+EARLIER  = "(earlier lines)"
+OUTSIDE  = "(no queue)"
+
+
+# Returns every class of queue, including subclasses of subclasses.
+#
+def queue_classes():
+    found, stack = [], [Queue]
+    while stack:
+        for cls in stack.pop().__subclasses__():
+            if cls not in found:
+                found.append(cls)
+                stack.append(cls)
+    return found
+
+
+class Profile:
+    def __init__(self):
+        self.classes = {}       # name of a class  -> list of COUNTS
+        self.nodes   = {}       # label of a node  -> list of COUNTS
+        self.origin  = {}       # id of a queue    -> label of its node
+        self.ends    = {}       # id of a tree and an end -> its token there
+        self.charged = [OUTSIDE]
+        self.batched = set()    # ids of queues in next_batch or skip
+        self.saved   = None
+
+    def _count(self, queue, what, n = 1):
+        name = type(queue).__name__
+        self.classes.setdefault(name, [0] * len(COUNTS))[what] += n
+        label = self.origin.get(id(queue), EARLIER)
+        self.nodes.setdefault(label, [0] * len(COUNTS))[what] += n
+
+    # Returns the first (end = 0) or last (end = -1) token of a tree, or None
+    #   if it ends in an empty literal, remembering it so that going up a deep
+    #   tree node by node doesn't walk down it again each time.
+    def _span(self, node, end):
+        path = []
+        while isinstance(node, ParseTree):
+            if (id(node), end) in self.ends:
+                node = self.ends[id(node), end]
+                break
+            path.append(node)
+            node = node.children[end] if node.children else None
+        for tree in path:
+            self.ends[id(tree), end] = node
+        return node
+
+    def label(self, node):
+        if isinstance(node, Token):
+            txt = node.txt if len(node.txt) <= 20 else node.txt[:17] + "..."
+            return f"{node.cls} {txt} @ {node.ln},{node.col}"
+        if isinstance(node, list):
+            # The children of a literal, for packLiteral.
+            kind, children = 'literal', node
+        else:
+            kind, children = node.kind, node.children
+        if not children:
+            return f"{kind} @ ?"
+        first, last = self._span(children[0], 0), self._span(children[-1], -1)
+        if first is None or last is None:
+            return f"{kind} @ ?"
+        if first is last:
+            return f"{kind} @ {first.ln},{first.col}"
+        return f"{kind} @ {first.ln},{first.col}-{last.ln},{last.col}"
+
+    ############################################################################
+
+    def _wrap(self, cls, name, method):
+        profile = self
+        if name == '__init__':
+            def wrapper(queue, *args):
+                # (A subclass that calls its parent's __init__ is only counted
+                #   once, as itself.)
+                if type(queue) is cls:
+                    profile.origin[id(queue)] = profile.charged[-1]
+                    profile._count(queue, 3)
+                method(queue, *args)
+        elif name == '__del__':
+            def wrapper(queue):
+                # Ids are reused once their queues are gone.
+                profile.origin.pop(id(queue), None)
+        elif name == '__next__':
+            def wrapper(queue):
+                # (Within a batch, the batch does the counting.)
+                if type(queue) is not cls or id(queue) in profile.batched:
+                    return method(queue)
+                profile._count(queue, 0)
+                profile.charged.append(profile.origin.get(id(queue), EARLIER))
+                try:
+                    return method(queue)
+                except StopIteration:
+                    profile._count(queue, 2)
+                    raise
+                finally:
+                    profile.charged.pop()
+        elif name in ('next_batch', 'skip'):
+            def wrapper(queue, n):
+                # (Like Queue.skip, which calls next_batch, or next_batch,
+                #   which calls next(), a batch may be made of other calls on
+                #   the same queue, which mustn't be counted again.)
+                if type(queue) is not cls or id(queue) in profile.batched:
+                    return method(queue, n)
+                profile.charged.append(profile.origin.get(id(queue), EARLIER))
+                profile.batched.add(id(queue))
+                try:
+                    out = method(queue, n)
+                finally:
+                    profile.batched.discard(id(queue))
+                    profile.charged.pop()
+                # (A batch that comes up short stands for one more call to
+                #   next(), which raised StopIteration.)
+                k = out if name == 'skip' else len(out)
+                profile._count(queue, 0, k if k == n else k + 1)
+                if k < n:
+                    profile._count(queue, 2)
+                return out
+        else:
+            def wrapper(queue, *args):
+                if type(queue) is not cls:
+                    return method(queue, *args)
+                if name == 'copy':
+                    profile._count(queue, 1)
+                profile.charged.append(profile.origin.get(id(queue), EARLIER))
+                try:
+                    return method(queue, *args)
+                finally:
+                    profile.charged.pop()
+        return wrapper
+
+    # makeQueue builds every queue with one of these, so wrapping them tells
+    #   which node each queue was built for.
+    def _builder(self, function, node_of):
+        profile = self
+        def wrapper(*args):
+            label = profile.label(node_of(*args))
+            profile.charged.append(label)
+            try:
+                queue = function(*args)
+            finally:
+                profile.charged.pop()
+            if queue is not None:
+                profile.origin.setdefault(id(queue), label)
+            return queue
+        return wrapper
+
+    def __enter__(self):
+        # Every original is looked up before anything's replaced, so that a
+        #   subclass doesn't end up calling its parent's wrapper.
+        originals = [(cls, name, cls.__dict__.get(name), getattr(cls, name, None))
+                     for cls in queue_classes()
+                     for name in METHODS + ('__init__', '__del__')]
+        self.saved = [(evaluator, name, getattr(evaluator, name))
+                      for name in ('makeLeaf', 'makeNode', 'packLiteral')]
+        for cls, name, own, method in originals:
+            self.saved.append((cls, name, own))
+            if name == '__del__' or method is not None:
+                setattr(cls, name, self._wrap(cls, name, method))
+        evaluator.makeLeaf    = self._builder(evaluator.makeLeaf,    lambda node: node)
+        evaluator.makeNode    = self._builder(evaluator.makeNode,    lambda node, *_: node)
+        evaluator.packLiteral = self._builder(evaluator.packLiteral, lambda parts: parts)
+        return self
+
+    def __exit__(self, *exc):
+        for owner, name, original in reversed(self.saved):
+            if original is not None:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self.saved = None
+        # Nothing that's left can be told apart by id any more.
+        self.origin = {}
+        self.ends = {}
+        return False
+
+    ############################################################################
+
+    # Prints the counts for the classes and nodes that did the most, busiest
+    #   first.
+    def report(self, limit = 20):
+        if not self.classes:
+            print("\x1B[2mprofile: no queues were used\x1B[22m")
+            return
+        head = "".join(f"{what:>10}" for what in COUNTS)
+        for title, table in (("class", self.classes), ("node", self.nodes)):
+            rows = sorted(table.items(), key=lambda row: -sum(row[1]))
+            width = max(len(title), *(len(key) for key, _ in rows[:limit]))
+            print(f"\x1B[2m{title:{width}}{head}\x1B[22m")
+            for key, counts in rows[:limit]:
+                print(f"{key:{width}}" + "".join(f"{n:10}" for n in counts))
+            if len(rows) > limit:
+                print(f"\x1B[2m... and {len(rows) - limit} more\x1B[22m")
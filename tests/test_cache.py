@@ -0,0 +1,60 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import cache, optimizer
+from lexer  import TokenStream
+from parser import parse_line, extract_tokens
+
+
+PROGRAM = 'x := "a\\"b" ~ 3 + [1, $x, []]\n' \
+          'printNum _(2 * x) ~ ^"cd"\n' \
+          'y := ' + "[" * 200 + "]" * 200 + '\n' \
+          'printRepr y + getNum\n'
+
+# Returns the optimized trees of the program's lines, as a script would.
+#
+def trees(text):
+    stream, out = TokenStream(text), []
+    while not stream.finished():
+        tree = parse_line(stream)
+        if tree is not None:
+            out.append(optimizer.optimize(tree)[0])
+    return out
+
+def entry(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'DIRECTORY', str(tmp_path))
+    path = tmp_path / "test.dq"
+    path.write_text(PROGRAM)
+    return cache.key(str(path))
+
+
+# What's loaded from the cache is what was stored: the same trees, made of the
+#   same tokens, down to their text, line and column.
+#
+def test_round_trip(tmp_path, monkeypatch):
+    key, program = entry(tmp_path, monkeypatch), trees(PROGRAM)
+    assert len(program) == 4
+    cache.store(key, program)
+    loaded = cache.load(key)
+    assert [repr(tree) for tree in loaded] == [repr(tree) for tree in program]
+    old, new = extract_tokens(program), extract_tokens(loaded)
+    assert len(old) == len(new)
+    assert all(a.isexactly(b) for a, b in zip(old, new))
+
+
+# An entry that's been cut short or scribbled over is a miss, and is deleted
+#   so that the next run can store it again.
+#
+def test_corrupt_entry_deleted(tmp_path, monkeypatch):
+    key = entry(tmp_path, monkeypatch)
+    cache.store(key, trees(PROGRAM))
+    [path] = tmp_path.glob("*.dqc")
+    data = path.read_bytes()
+    for corrupt in (data[:len(data) // 2],
+                    data[:len(cache.MAGIC) + len(key)] + b"\x00" * 40,
+                    b"DQC\x00" + data[4:]):
+        path.write_bytes(corrupt)
+        assert cache.load(key) is None
+        assert not path.exists()
+    cache.store(key, trees(PROGRAM))
+    assert cache.load(key) is not None
@@ -0,0 +1,133 @@
+import io, os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import evaluator
+
+
+# Runs a program as a script and returns what it printed, one line each.
+#
+def run(tmp_path, capsys, program):
+    evaluator.GLOBALS.clear()
+    path = tmp_path / "test.dq"
+    path.write_text(program + "\n")
+    assert evaluator.script(str(path), cached=False) == 0
+    return capsys.readouterr().out.splitlines()
+
+
+# A zip whose second half runs out first still takes an element from its first
+#   half every time it's asked, so printing `4 + a ~ 1` in batches has to ask
+#   it exactly as often as printing it an element at a time would.
+#
+def test_batched_print_leaves_shared_name(tmp_path, capsys):
+    out = run(tmp_path, capsys, "a := 5\n"
+                                "printRepr 4 + a ~ 1\n"
+                                "printNum a")
+    assert out == ["ε, ε, ε, ε, ε", "3"]
+
+def test_batched_skip_leaves_shared_name(tmp_path, capsys):
+    out = run(tmp_path, capsys, "a := 5\n"
+                                "printNum _[4 + a ~ 1]\n"
+                                "printNum a")
+    assert out == ["5", "3"]
+
+
+# Measuring a queue uses it up the same way as iterating over it, even where
+#   the closed form would drain a part that's asked again after it runs out.
+#
+def test_count_drains_like_iterating(tmp_path, capsys):
+    out = run(tmp_path, capsys, "a := 5\n"
+                                "printNum (a ~ 1) + 2\n"
+                                "printNum a\n"
+                                "a := 5\n"
+                                "x := (a ~ 1) + 2\n"
+                                "y := x + 3\n"
+                                "printNum y\n"
+                                "printNum a")
+    assert out == ["3", "1", "6", "0"]
+
+
+# Queues nested far deeper than Python's own stack can still be measured.
+#
+def test_count_deeply_nested(tmp_path, capsys):
+    out = run(tmp_path, capsys, "x := 5\n" + "x := x ~ 5\n" * 600 +
+                                "printNum x")
+    assert out == ["5"]
+
+
+# Flattens nested in each other are iterated without recursing, whether each
+#   one is the queue of the next (___[[[x]]]) or one of its elements (_[_[x]]).
+#
+def test_count_deeply_nested_flatten(tmp_path, capsys):
+    n = 100000
+    out = run(tmp_path, capsys, 'x := "abc"\n'
+                                "printNum " + "_" * n + "[" * n + "x" + "]" * n +
+                                '\nx := "abc"\n'
+                                "printNum " + "_[" * n + "x" + "]" * n)
+    assert out == ["3", "3"]
+
+
+# A line that's just an expression is held to PREVIEW's limits, and a print
+#   command to GOVERNOR's.
+#
+def test_implicit_print_limits(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(evaluator.PREVIEW, "steps", 10)
+    out = run(tmp_path, capsys, "$1\n"
+                                "printNum _(20 ~ $[1])")
+    assert out[0].endswith("output truncated after more than 10 steps")
+    assert out[1:] == ["20"]
+
+
+# A line that doesn't lex or parse stops the script with status 1, after what
+#   came before it has been printed, and the error goes to stderr.
+#
+def test_script_errors(tmp_path, capsys):
+    path = tmp_path / "test.dq"
+    for line, message in [('print "abc', "line 2: unterminated string"),
+                          ("print (1", "line 2: ")]:
+        path.write_text("print 1\n" + line + "\nprint 2\n")
+        assert evaluator.script(str(path), cached=False) == 1
+        out, err = capsys.readouterr()
+        assert out == "1\n"
+        assert message in err
+
+
+# A star or flatten that's bound to a name isn't folded, since its copies
+#   start over at its next element, where a natural's or a string's copies
+#   go on from wherever it's got to.
+#
+def test_copy_after_partly_taking_star_and_flatten(tmp_path, capsys):
+    for expr, copied in [("3*2", 3), ('_"ab"', 98), ('2*"ab"', 100),
+                         ('"ab"*2', 2), ("(3*2)+1", 4), ("(3*2)~5", 3)]:
+        out = run(tmp_path, capsys, f"x := {expr}\n"
+                                    "printNum 1 ~ x\n"
+                                    "printNum _(1 ~ $x)")
+        assert out == ["1", str(copied)], expr
+
+
+# ^x is _(1~x), and stays that way after it's been partly taken and copied.
+#
+def test_take_agrees_with_flattened_zip(tmp_path, capsys):
+    for expr in ['"a"', '"ab"', "3"]:
+        outs = [run(tmp_path, capsys, f"x := {take}\n"
+                                      "printNum 1 ~ x\n"
+                                      "printNum _(1 ~ $x)\n"
+                                      "printNum (x + 1)")
+                for take in [f"^{expr}", f"_(1 ~ {expr})"]]
+        assert outs[0] == outs[1], expr
+
+
+# get, getNum, and getStr read the same input however it's split into chunks,
+#   including numbers, lines, and runs of characters that span two of them.
+#
+def test_input_across_chunks(tmp_path, capsys, monkeypatch):
+    text = "12 345\nab6789 0 x42\n\nlast"
+    for size in [1, 2, 3, 5, 1 << 16]:
+        monkeypatch.setattr(evaluator, 'CHUNK_SIZE', size)
+        for program, printed in [("x := getNum\nprintNum ^x\nprintNum ^x\nprintNum _x",
+                                  ["12", "345", "6831"]),
+                                 ("x := get\nprintStr ^x\nprintStr ^x\nprintNum x",
+                                  ["12 345", "ab6789 0 x42", "2"]),
+                                 ("x := getStr\nprintStr 5 ~ x\nprintNum x",
+                                  ["12 34", str(len(text) - 5)])]:
+            monkeypatch.setattr(evaluator, 'INPUT', evaluator.Input(io.StringIO(text)))
+            assert run(tmp_path, capsys, program) == printed, (size, program)
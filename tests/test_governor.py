@@ -0,0 +1,17 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from governor import Governor, Exhausted
+
+
+# The timer only notes that a limit tripped, since it can go off in the middle
+#   of a queue taking an element; Exhausted waits for the next check().
+#
+def test_timer_waits_for_check():
+    limits = Governor(seconds=0)
+    with limits:
+        limits.watch()
+        with pytest.raises(Exhausted, match="more than 0 seconds"):
+            limits.check()
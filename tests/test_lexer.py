@@ -0,0 +1,34 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer import TokenStream
+
+
+# Returns every token of the text, asking more() for the rest of it, as the
+#   fields that have to come out the same however the text is split. (All but
+#   the text of a newline, which is the whitespace seen up to the end of the
+#   chunk: the lexer can't wait on the next one without stalling the REPL.)
+#
+def lex(text, more = None):
+    stream, out = TokenStream(text, more), []
+    while (tok := next(stream)) is not None:
+        out.append((tok.txt if tok.cls != 'newline' else None,
+                    tok.ln, tok.col, tok.val, tok.cls))
+    return out
+
+
+# Text that arrives in chunks lexes to the same tokens, at the same lines and
+#   columns, wherever the chunks happen to split it (in the middle of a name,
+#   a number, a string, an escape, or an operator like :=).
+#
+PROGRAM = 'xy := "a\\"bc" ~ 123 + [yz, 45]\n' \
+          'printNum _$xy * 6789\n' \
+          '\n' \
+          'printStr "de\\nf" + ^getNum\n'
+
+def test_chunks_lex_the_same():
+    whole = lex(PROGRAM)
+    for size in range(1, 9):
+        chunks = [PROGRAM[i:i+size] for i in range(0, len(PROGRAM), size)]
+        rest = iter(chunks[1:])
+        assert lex(chunks[0], lambda: next(rest, "")) == whole, size
@@ -0,0 +1,27 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lexer     import Token, TokenStream
+from parser    import parse_line
+from optimizer import optimize
+
+
+def folded(line):
+    tree, eliminated = optimize(parse_line(TokenStream(line + "\n")))
+    return tree.children[1]
+
+
+# A star, flatten or take is folded where it's printed, but not where it's
+#   bound to a name (see optimizer.fold), unless it's inside a list or a
+#   factory. Concatenations and zips are folded either way.
+#
+def test_fold_unless_copied():
+    assert isinstance(folded('printNum 2*"ab"'), Token)
+    assert isinstance(folded('printNum _"ab"'), Token)
+    assert not isinstance(folded('x := 2*"ab"'), Token)
+    assert not isinstance(folded('x := (_"ab") + 1'), Token)
+    assert isinstance(folded('printNum ^"ab"'), Token)
+    assert not isinstance(folded('x := ^"ab"'), Token)
+    assert isinstance(folded('x := ["a", 2*"ab"]').children[1], Token)
+    assert isinstance(folded('x := "a" + "b"'), Token)
+    assert isinstance(folded('x := 3 ~ "abcd"'), Token)
@@ -0,0 +1,59 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pytest
+
+from lexer  import TokenStream
+from parser import ParseError, Climber, Unparsable, _parse, _parse_legacy, extract_tokens
+
+
+# Returns the tokens of a one-line program, without the newline at its end.
+#
+def tokens(text):
+    stream, line = TokenStream(text + "\n"), []
+    while (tok := next(stream)) is not None:
+        if tok.cls != 'newline':
+            line.append(tok)
+    return line
+
+
+# The precedence-climbing parser builds the same trees as the legacy one,
+#   without handing the line over to it.
+#
+def test_climbing_matches_legacy():
+    for text in ['1 + 2 * 3 ~ 4',
+                 '1 ~ 2 * 3 + 4',
+                 '(1 + 2) * [3, 4 ~ 5, []]',
+                 '_$x',
+                 '_^x',
+                 '^$x ~ _^$y',
+                 'x := _$x + ^$x * 2 ~ _^"ab"',
+                 'printNum _x ~ $y + 3',
+                 'x := := 3',
+                 '1 2']:
+        line = tokens(text)
+        assert repr(Climber(line).parse(True)) == repr(_parse_legacy(line, True)), text
+        assert repr(_parse(line, True)) == repr(_parse_legacy(line, True)), text
+
+
+# Lines the climbing parser gives up on get the legacy parser's error, with
+#   the same highlight.
+#
+def test_errors_fall_back_to_legacy():
+    for text in ['$_x',
+                 '^_x',
+                 'x := $^x ~ 1',
+                 '1 + * 2',
+                 'print (1',
+                 '[1, 2',
+                 '1 +',
+                 '^']:
+        line = tokens(text)
+        with pytest.raises(Unparsable):
+            Climber(line).parse(True)
+        new, old = _parse(line, True), _parse_legacy(line, True)
+        assert isinstance(new, ParseError), text
+        assert (new.message, new.redux) == (old.message, old.redux), text
+        assert extract_tokens(new.highlight) == extract_tokens(old.highlight), text
+        assert all(a.isexactly(b) for a, b in zip(extract_tokens(new.highlight),
+                                                   extract_tokens(old.highlight))), text
@@ -0,0 +1,24 @@
+import io, os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import evaluator, profiler
+from lexer  import TokenStream
+from parser import parse_line
+
+
+# Elements taken in batches are counted as if they'd been taken one at a time:
+#   printing _[x, x, "q"] asks the string bound to x for its 8 characters and
+#   once more when it runs out, and then once more for the second x.
+#
+def test_batches_count_as_next():
+    evaluator.GLOBALS.clear()
+    evaluator.GLOBALS['x'] = evaluator.String("abcdefgh")
+    tree = parse_line(TokenStream('printNum _[x, x, "q"]\n'))
+    out = evaluator.Writer(io.StringIO())
+    profile = profiler.Profile()
+    with profile:
+        evaluator.execute(tree, out)
+    out.flush()
+    assert out.out.getvalue() == "9\n"
+    assert profile.classes['String'] == [12, 0, 3, 1]
+    assert profile.classes['Flatten'][:3] == [10, 0, 1]
@@ -0,0 +1,125 @@
+import json, os
+from contextlib import nullcontext
+from time import perf_counter
+
+# Records how long each stage of running a script takes, as a trace that
+#   chrome://tracing and ui.perfetto.dev can show as a timeline. Each line of
+#   the script gets a span, with a span inside it for each stage:
+#
+#   lex        reading the line's tokens
+#   parse      turning them into a tree
+#   optimize   folding the tree
+#   build      turning the tree into a queue (makeQueue)
+#   smartPrint (or whichever printer the line uses), inside which
+#     iterate  is time spent taking elements and turning them into text, and
+#     write    is time spent handing that text to the output
+#
+# Since queues are lazy, the elements are only worked out as they're printed,
+#   so iterate and write take turns, split wherever the Writer flushes.
+#
+# Every span is tagged with the line of the script it belongs to.
+
+
+class Timeline:
+    def __init__(self, name):
+        self.start  = perf_counter()
+        self.line   = None      # the line that's being run
+        self.marked = None      # when the current iterate span started
+        self.events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(),
+                        'args': {'name': name}}]
+
+    def now(self):
+        return perf_counter()
+
+    # Records a span, in the trace's units of microseconds from the start.
+    def add(self, name, start, end, **args):
+        if self.line is not None:
+            args['line'] = self.line
+        self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                            'ts':  (start - self.start) * 1e6,
+                            'dur': (end - start) * 1e6,
+                            'args': args})
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def printing(self, name, **args):
+        return Printing(self, name, args)
+
+    # Wraps a Writer's flush so that each one shows up as a write span, and
+    #   splits the printer that's running at the time (if any) around it.
+    def watch(self, writer):
+        flush = writer.flush
+        def traced():
+            start = self.now()
+            if self.marked is not None:
+                self.add('iterate', self.marked, start)
+            flush()
+            end = self.now()
+            self.add('write', start, end)
+            if self.marked is not None:
+                self.marked = end
+        writer.flush = traced
+
+    # Saves the trace to the named file. Returns an error message if it can't.
+    def save(self, path):
+        try:
+            with open(path, 'w') as file:
+                json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, file)
+        except OSError as error:
+            return f"can't write {path}: {error.strerror}"
+        return None
+
+
+class Span:
+    def __init__(self, timeline, name, args):
+        self.timeline = timeline
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.begun = self.timeline.now()
+        return self
+
+    def __exit__(self, *exc):
+        self.timeline.add(self.name, self.begun, self.timeline.now(), **self.args)
+        return False
+
+
+# A span around a printer, which is split into iterate spans wherever its
+#   output is flushed (see Timeline.watch).
+#
+class Printing(Span):
+    def __enter__(self):
+        Span.__enter__(self)
+        self.timeline.marked = self.begun
+        return self
+
+    def __exit__(self, *exc):
+        end = self.timeline.now()
+        self.timeline.add('iterate', self.timeline.marked, end)
+        self.timeline.marked = None
+        self.timeline.add(self.name, self.begun, end, **self.args)
+        return False
+
+
+# Stands in for a Timeline when nothing's being recorded.
+#
+class Untimed:
+    line = None
+
+    def now(self):
+        return 0
+
+    def add(self, name, start, end, **args):
+        pass
+
+    def span(self, name, **args):
+        return nullcontext()
+
+    printing = span
+
+    def watch(self, writer):
+        pass
+
+UNTIMED = Untimed()